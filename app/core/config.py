@@ -1,9 +1,43 @@
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     database_url : str
+    # read-only replica for fact and dimension queries, the primary when unset
+    database_replica_url : Optional[str] = None
+    # per engine and worker process, reads and writes have one engine each
+    db_pool_size : int = 10
+    db_max_overflow : int = 20
+    db_pool_pre_ping : bool = True
+    db_pool_recycle : int = 30 * 60
+    sql_echo : bool = False
     redis_host : str
     redis_port : str
+
+    local_cache_max_bytes : int = 64 * 1024 * 1024
+    local_cache_ttl : int = 60
+    dimension_refresh_seconds : int = 6 * 60 * 60
+    # watermark probe period; data:* entries are keyed by table version and
+    # only expire as a safety net for versions that were never swept
+    data_version_seconds : int = 30
+    data_cache_ttl : int = 24 * 60 * 60
+    # previous version entries are still served this long while the new one fills
+    stale_grace_seconds : int = 60
+    # upper bound on one table load, other workers wait at most this long for it
+    fill_lock_seconds : int = 30
+    # query shapes refilled after a load, counted per worker and flushed to Redis
+    prewarm_top_n : int = 20
+    prewarm_flush_seconds : int = 60
+    # verified credentials kept per worker, so an expired auth:* entry does
+    # not cost a DB lookup and salted hash on every worker
+    credential_cache_ttl : int = 10 * 60
+    credential_cache_max_bytes : int = 8 * 1024 * 1024
+    # failed key name / secret pairs answered from Redis without the DB
+    auth_fail_ttl : int = 60
+    # Bloom filter of existing key names in a Redis bitmap, off by default
+    key_name_filter : bool = False
+    key_name_filter_bits : int = 1 << 20
+    key_name_filter_hashes : int = 7
     model_config = SettingsConfigDict(env_file=".env")
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
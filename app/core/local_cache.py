@@ -0,0 +1,66 @@
+import time
+from collections import OrderedDict
+
+
+class LocalCache:
+    """Bounded in-process LRU cache in front of Redis, entries expire after their TTL."""
+
+    def __init__(self, max_bytes: int, default_ttl: int):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, size, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value, ttl: int = None, size: int = None):
+        if size is None:
+            size = len(value)
+        if size > self.max_bytes:
+            return False
+        if key in self._entries:
+            self._remove(key)
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.default_ttl)
+        self._entries[key] = (value, size, expires_at)
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+        return True
+
+    def delete(self, key: str):
+        if key in self._entries:
+            self._remove(key)
+
+    def invalidate(self, prefix: str = ""):
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            self._remove(key)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
@@ -1,6 +1,9 @@
-from sqlmodel import create_engine, Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 from core.config import settings
-import redis
+from core.local_cache import LocalCache
+import redis.asyncio as redis
 
 redis_pool = redis.Redis(
     host=settings.redis_host,
@@ -9,14 +12,68 @@ redis_pool = redis.Redis(
           socket_connect_timeout=1,
             socket_timeout=2)
 
-engine = create_engine(settings.database_url, echo=True)
+# same server without response decoding, cached bodies may be binary
+redis_data_pool = redis.Redis(
+    host=settings.redis_host,
+      port=settings.redis_port,
+        decode_responses=False,
+          socket_connect_timeout=1,
+            socket_timeout=2)
+
+
+def async_database_url(database_url: str):
+    # keep accepting the pyodbc URL from .env, aioodbc takes the same DSN
+    url = make_url(database_url)
+    if url.drivername == "mssql+pyodbc":
+        url = url.set(drivername="mssql+aioodbc")
+    return url
+
+# one per worker process, kept in sync across workers through Redis pub/sub
+local_cache = LocalCache(settings.local_cache_max_bytes, settings.local_cache_ttl)
+# credential:{key_name}:{digest} -> APIkey json of a secret verified against the DB
+credential_cache = LocalCache(settings.credential_cache_max_bytes, settings.credential_cache_ttl)
+
+def make_engine(database_url: str):
+    return create_async_engine(
+        async_database_url(database_url),
+        echo=settings.sql_echo,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_recycle=settings.db_pool_recycle,
+    )
+
+# primary: api_keys reads and writes, which must see their own changes
+engine = make_engine(settings.database_url)
+# fact and dimension reads, on their own pool so they never hold key management
+# up; against the primary too when no replica is configured
+read_engine = make_engine(settings.database_replica_url or settings.database_url)
 
-def get_session():
-    with Session(engine) as session:
+def new_session():
+    # for work that runs beside the request session, e.g. concurrent batch fills
+    return AsyncSession(engine, expire_on_commit=False)
+
+def new_read_session():
+    return AsyncSession(read_engine, expire_on_commit=False)
+
+async def get_session():
+    async with new_session() as session:
+        yield session
+
+async def get_read_session():
+    async with new_read_session() as session:
         yield session
 
-def get_redis():
+async def get_redis():
     try:
         yield redis_pool
     finally:
-        pass
\ No newline at end of file
+        pass
+
+
+async def get_redis_data():
+    yield redis_data_pool
+
+
+def get_local_cache():
+    return local_cache
@@ -1,5 +1,7 @@
 from db import APIkey
-from sqlmodel import Session
+from sqlmodel import select, update
+from sqlalchemy import bindparam
+from sqlmodel.ext.asyncio.session import AsyncSession
 from .utilities import verify_APIkey_hashedkey
 from schemas.schemas import create_API_key_schema, upload_API_key_schema
 import hashlib
@@ -9,11 +11,11 @@ from datetime import datetime
 
 
 class APIService:
-    def __init__(self, session: Session):
+    def __init__(self, session: AsyncSession):
         self.session = session
 
 
-    def create_api_key(self, api_key_schema: create_API_key_schema):
+    async def create_api_key(self, api_key_schema: create_API_key_schema):
         
         key_name = api_key_schema.key_name
         owner_email = api_key_schema.owner_email
@@ -23,7 +25,7 @@ class APIService:
             return None
         
         # check if key_name exists
-        if self.keyname_exists(key_name):
+        if await self.keyname_exists(key_name):
             return None
     
         key_value = self.generate_APIkey()
@@ -34,8 +36,8 @@ class APIService:
             key_value=self.hash_APIkey(key_value))
         
         self.session.add(new_api_key)
-        self.session.commit()
-        self.session.refresh(new_api_key)
+        await self.session.commit()
+        await self.session.refresh(new_api_key)
 
         return upload_API_key_schema(
             key_name=new_api_key.key_name,
@@ -51,9 +53,9 @@ class APIService:
         hashed_key = hashlib.sha256(salt + api_key.encode()).hexdigest()
         return f"{salt.hex()}:{hashed_key}"
     
-    def verify_apikey(self, provided_key: str, keyname_provided : str) -> bool:
+    async def verify_apikey(self, provided_key: str, keyname_provided : str) -> bool:
         # check for duplicate key_name
-        hashed_key = self.get_api_key(keyname_provided)
+        hashed_key = await self.get_api_key(keyname_provided)
         if hashed_key is None:
             return False
         elif verify_APIkey_hashedkey(hashed_key.key_value, provided_key) and hashed_key.key_name == keyname_provided:
@@ -61,53 +63,74 @@ class APIService:
         return False
     
     
-    def get_api_key(self, key_name: str):
-        api_key = self.session.get(APIkey, key_name)
+    async def get_api_key(self, key_name: str):
+        api_key = await self.session.get(APIkey, key_name)
         return api_key
     
-    def keyname_exists(self, key_name: str):
-        existing_key = self.get_api_key(key_name)
+    async def keyname_exists(self, key_name: str):
+        existing_key = await self.get_api_key(key_name)
         if existing_key is None:
             return False
         return True
     
-    def check_rate_limit(self, key_name: str) -> bool:
-        api_key = self.get_api_key(key_name)
+    async def check_rate_limit(self, key_name: str) -> bool:
+        api_key = await self.get_api_key(key_name)
         if api_key is None:
             return False
         elif not isinstance(api_key, APIkey):
             return False
         return api_key.verify_rate_limit()
     
-    def reset_daily_limit(self, key_name: str):
-        api_key = self.get_api_key(key_name)
+    async def reset_daily_limit(self, key_name: str):
+        api_key = await self.get_api_key(key_name)
         if api_key is not None and isinstance(api_key, APIkey):
             api_key.reset_daily_limit()
             self.session.add(api_key)
-            self.session.commit()
+            await self.session.commit()
             return True
         return False
     
-    def update_last_request_date(self, key_name: str, date: datetime):
-        api_key = self.get_api_key(key_name)
+    async def update_last_request_date(self, key_name: str, date: datetime):
+        api_key = await self.get_api_key(key_name)
         if api_key is not None and isinstance(api_key, APIkey):
             api_key.set_last_request_date(date)
             self.session.add(api_key)
-            self.session.commit()
+            await self.session.commit()
             return True
         return False
     
-    def update_api_key(self, is_active: bool, requests_made_today: int, last_request_date: str, key_name: str):
+    async def update_api_key(self, is_active: bool, requests_made_today: int, last_request_date: str, key_name: str):
         try:
-            api_key = self.get_api_key(key_name)
+            api_key = await self.get_api_key(key_name)
             if api_key is not None and isinstance(api_key, APIkey):
                 api_key.is_active = is_active
                 api_key.requests_made_today = requests_made_today
-                api_key.last_request_date = datetime.fromisoformat(last_request_date)
+                if last_request_date:
+                    api_key.last_request_date = datetime.fromisoformat(last_request_date)
                 self.session.add(api_key)
-                self.session.commit()
+                await self.session.commit()
                 return True
             return False
         except Exception:
             import traceback
-            traceback.print_exc()
\ No newline at end of file
+            traceback.print_exc()
+
+    async def stream_key_names(self, batch_size: int = 1000):
+        """Every key name, in batches read through a server-side cursor."""
+        result = await self.session.stream_scalars(select(APIkey.key_name).execution_options(yield_per=batch_size))
+        async for names in result.partitions():
+            yield names
+
+    async def update_api_keys(self, rows: list):
+        """Write the usage of many keys, one executemany UPDATE per set of columns."""
+        # a Core UPDATE by key_name, a name without a row matches nothing instead of failing the batch
+        table = APIkey.__table__
+        batches = {}
+        for row in rows:
+            batches.setdefault(tuple(sorted(row)), []).append(row)
+        for batch in batches.values():
+            statement = update(table).where(table.c.key_name == bindparam("b_key_name"))
+            params = [{"b_key_name": row["key_name"], **{k: v for k, v in row.items() if k != "key_name"}} for row in batch]
+            await self.session.execute(statement, params)
+        await self.session.commit()
+        return len(rows)
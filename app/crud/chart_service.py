@@ -1,105 +1,78 @@
-from sqlmodel import Session, select, func, col, cast
-from sqlalchemy import DateTime
-from db import chartHistory, Date,Time,Coin,Currency,chartHistory, chartLive
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db import chartHistory, chartLive
 from schemas.schemas import chart_schema
+from datetime import datetime
+from .key_range import key_range, after_keys, to_keys, date_bounds, watermark_statement, data_version
+from .column_store import CHART_LAYOUT
+from .dimension_registry import dimension_registry
 
 
 class ChartService:
-    def __init__(self, session:Session):
+    def __init__(self, session:AsyncSession):
         self.session = session
 
-    def get_chart_history(self, limit: int = None, start_date: str = None, end_date: str = None):
-        statement = (
+    def chart_statement(self, table):
+        # fact columns only, labels come from the dimension registry
+        return (
             select(
-                # 1. CAST(CONCAT(...) AS DATETIME2)
-                cast(
-                    func.concat(Date.full_date, ' ', Time.time_of_day),
-                    DateTime
-                ).label("bitcoin_date"),
-                
-                # 2. Column Aliasing (.label in SQLAlchemy/SQLModel)
-                Coin.coin_id.label("coin_name"),
-                Currency.currency_code.label("currency_name"),
-                chartHistory.prices.label("price"),
-                chartHistory.market_caps.label("market_cap"),
-                chartHistory.total_volumes.label("total_volume")
+                table.date_key,
+                table.time_key,
+                table.coin_key,
+                table.currency_key,
+                table.prices.label("price"),
+                table.market_caps.label("market_cap"),
+                table.total_volumes.label("total_volume")
             )
-            # 3. Joins
-            .join(Coin, chartHistory.coin_key == Coin.coin_key)
-            .join(Currency, chartHistory.currency_key == Currency.currency_key)
-            .join(Date, chartHistory.date_key == Date.date_key)
-            .join(Time, chartHistory.time_key == Time.time_key)
-            .order_by(col(Date.full_date), col(Time.time_of_day))
+            .order_by(table.date_key, table.time_key)
         )
-        if start_date:
-            statement = statement.where(
-                func.concat(Date.full_date, ' ', Time.time_of_day) >= start_date
-            )
-        if end_date:
-            statement = statement.where(
-                func.concat(Date.full_date, ' ', Time.time_of_day) <= end_date
-            )
-        statement = statement.limit(limit)
 
-        results = self.session.exec(statement).all()
+    async def get_chart_store(self, type: str):
+        """Whole history or lastday table as a ColumnStore, without a chart_schema per row."""
+        table = chartLive if type == "lastday" else chartHistory
+        results = (await self.session.exec(self.chart_statement(table))).all()
+        return await dimension_registry.build_store(self.session, CHART_LAYOUT, results)
 
-        schema = [
-            chart_schema(
-                bitcoin_date=row.bitcoin_date,
-                coin_name=row.coin_name,
-                currency_name=row.currency_name,
-                price=row.price,
-                market_cap=row.market_cap,
-                total_volume=row.total_volume
-            )
-            for row in results
-        ]
-        return schema
+    async def get_chart_version(self, type: str):
+        table = chartLive if type == "lastday" else chartHistory
+        return data_version((await self.session.exec(watermark_statement(table))).first())
 
-    def get_chart_lastday(self, limit : int = None, start_time: str = None, end_time: str = None):
-        statement = (
-            select(
-                # 1. CAST(CONCAT(...) AS DATETIME2)
-                cast(
-                    func.concat(Date.full_date, ' ', Time.time_of_day),
-                    DateTime
-                ).label("bitcoin_date"),
-                
-                # 2. Column Aliasing (.label in SQLAlchemy/SQLModel)
-                Coin.coin_id.label("coin_name"),
-                Currency.currency_code.label("currency_name"),
-                chartLive.prices.label("price"),
-                chartLive.market_caps.label("market_cap"),
-                chartLive.total_volumes.label("total_volume")
-            )
-            # 3. Joins
-            .join(Coin, chartLive.coin_key == Coin.coin_key)
-            .join(Currency, chartLive.currency_key == Currency.currency_key)
-            .join(Date, chartLive.date_key == Date.date_key)
-            .join(Time, chartLive.time_key == Time.time_key)
-            .order_by(col(Date.full_date), col(Time.time_of_day))
-        )
-    
-        if start_time:
-            statement = statement.where(Time.time_of_day >= start_time)
-        if end_time:
-            statement = statement.where(Time.time_of_day <= end_time)
+    def chart_history_statement(self, limit: int = None, start_date: str = None, end_date: str = None, since: datetime = None):
+        statement = self.chart_statement(chartHistory)
+        statement = statement.where(*key_range(chartHistory, *date_bounds(start_date, end_date)))
+        if since:
+            statement = statement.where(after_keys(chartHistory, *to_keys(since)))
+        return statement.limit(limit)
+
+    async def stream_chart_history(self, limit: int = None, start_date: str = None, end_date: str = None, since: datetime = None, batch_size: int = 1000):
+        """Labelled history rows in batches, read through a server-side cursor."""
+        await dimension_registry.ensure(self.session)
+        statement = self.chart_history_statement(limit, start_date, end_date, since)
+        result = await self.session.stream(statement.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield dimension_registry.labels(rows)
 
-        statement = statement.limit(limit)
+    def chart_page_statement(self, after: tuple, end_date: str = None, limit: int = None):
+        statement = self.chart_statement(chartHistory)
+        statement = statement.where(after_keys(chartHistory, *after))
+        statement = statement.where(*key_range(chartHistory, *date_bounds(None, end_date)))
+        return statement.limit(limit)
 
-        results = self.session.exec(statement).all()
+    async def get_chart_page(self, after: tuple, end_date: str = None, limit: int = None):
+        """Page after the (date_key, time_key) of a cursor, an index seek whatever the offset."""
+        statement = self.chart_page_statement(after, end_date, limit)
+        results = (await self.session.exec(statement)).all()
+        return await self.to_schema(results)
 
-        schema = [
+    async def to_schema(self, results):
+        return [
             chart_schema(
-                bitcoin_date=row.bitcoin_date,
-                coin_name=row.coin_name,
-                currency_name=row.currency_name,
+                bitcoin_date=timestamp,
+                coin_name=coin_name,
+                currency_name=currency_name,
                 price=row.price,
                 market_cap=row.market_cap,
                 total_volume=row.total_volume
             )
-            for row in results
+            for timestamp, coin_name, currency_name, row in await dimension_registry.label_rows(self.session, results)
         ]
-        return schema
-    
-
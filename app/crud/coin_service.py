@@ -1,13 +1,14 @@
 from schemas.schemas import coin_schema
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from db import Coin
 
 
 class CoinService:
-    def __init__(self, session : Session):
+    def __init__(self, session : AsyncSession):
         self.session = session
 
-    def get_all_coins(self):
+    async def get_all_coins(self):
         statement = (
             select(
                 Coin.coin_key,
@@ -18,7 +19,7 @@ class CoinService:
                 Coin.is_active
             )
         )
-        results = self.session.exec(statement).all()
+        results = (await self.session.exec(statement)).all()
 
         return [
             coin_schema(
@@ -0,0 +1,186 @@
+import json
+from datetime import date, datetime, time
+from typing import NamedTuple
+
+import numpy as np
+
+from .key_range import date_bounds, resolve_time_of_day, naive_utc
+
+
+class StoreLayout(NamedTuple):
+    timestamp_field: str
+    # chart_schema serializes "YYYY-MM-DDTHH:MM:SS", ohlc_schema uses str(datetime)
+    timestamp_separator: str
+    label_fields: tuple
+    value_fields: tuple
+
+
+CHART_LAYOUT = StoreLayout("bitcoin_date", "T", ("coin_name", "currency_name"), ("price", "market_cap", "total_volume"))
+OHLC_LAYOUT = StoreLayout("timestamp", " ", ("coin_name", "currency_name"), ("open", "high", "low", "close"))
+# resampled chart prices, volume is the last total_volume seen in the bucket
+CANDLE_LAYOUT = StoreLayout("timestamp", " ", ("coin_name", "currency_name"), ("open", "high", "low", "close", "volume"))
+LAYOUTS = {"chart": CHART_LAYOUT, "ohlc": OHLC_LAYOUT}
+
+INTERVAL_UNITS = {"m": 60, "h": 60 * 60, "d": 24 * 60 * 60, "w": 7 * 24 * 60 * 60}
+# longest candle, the fact tables hold 90 days at most
+MAX_INTERVAL = INTERVAL_UNITS["w"]
+# the epoch was a Thursday, weekly buckets are shifted to start on Monday
+WEEK_OFFSET = 4 * INTERVAL_UNITS["d"]
+
+
+class ColumnStore:
+    """In-memory fact table held as contiguous NumPy columns sorted by epoch seconds."""
+    # labels are dictionary encoded, range lookups are a searchsorted and slices are views
+
+    def __init__(self, layout: StoreLayout, timestamps: np.ndarray, labels: dict, values: dict):
+        self.layout = layout
+        self.timestamps = timestamps
+        self.labels = labels  # field -> (codes, categories)
+        self.values = values  # field -> float64 array
+
+    @classmethod
+    def from_columns(cls, layout: StoreLayout, timestamps: list, labels: dict, values: dict):
+        encoded = {}
+        for field in layout.label_fields:
+            categories, codes = np.unique(
+                np.array(labels[field], dtype=object).astype(str), return_inverse=True
+            )
+            encoded[field] = (codes.astype(np.int32), categories.tolist())
+        return cls(
+            layout,
+            np.array(timestamps, dtype="datetime64[s]").astype(np.int64),
+            encoded,
+            {field: np.array(values[field], dtype=np.float64) for field in layout.value_fields},
+        )
+
+    @classmethod
+    def from_json(cls, layout: StoreLayout, raw):
+        data = json.loads(raw)
+        return cls(
+            layout,
+            np.array(data["timestamps"], dtype=np.int64),
+            {
+                field: (np.array(label["codes"], dtype=np.int32), label["categories"])
+                for field, label in data["labels"].items()
+            },
+            {field: np.array(column, dtype=np.float64) for field, column in data["values"].items()},
+        )
+
+    def to_json(self):
+        """Compact columnar form used to share the table through Redis."""
+        return json.dumps({
+            "timestamps": self.timestamps.tolist(),
+            "labels": {
+                field: {"codes": codes.tolist(), "categories": categories}
+                for field, (codes, categories) in self.labels.items()
+            },
+            "values": {field: column.tolist() for field, column in self.values.items()},
+        }, separators=(",", ":"))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def nbytes(self):
+        return (
+            self.timestamps.nbytes
+            + sum(codes.nbytes for codes, _ in self.labels.values())
+            + sum(column.nbytes for column in self.values.values())
+        )
+
+    def take(self, indexer):
+        """Rows selected by a slice, an index array or a boolean mask."""
+        return ColumnStore(
+            self.layout,
+            self.timestamps[indexer],
+            {field: (codes[indexer], categories) for field, (codes, categories) in self.labels.items()},
+            {field: column[indexer] for field, column in self.values.items()},
+        )
+
+    def slice(self, start: datetime = None, end: datetime = None, limit: int = None):
+        lo = int(np.searchsorted(self.timestamps, to_epoch(start), side="left")) if start else 0
+        hi = int(np.searchsorted(self.timestamps, to_epoch(end), side="right")) if end else len(self)
+        if limit is not None:
+            hi = min(hi, lo + max(limit, 0))
+        return self.take(slice(lo, hi))
+
+    def resample(self, interval: int):
+        """OHLC+volume bars of interval seconds, one per bucket and coin/currency pair."""
+        # buckets are floored on the epoch like the Time is_*_interval flags, weeks start on Monday
+        offset = WEEK_OFFSET if interval % INTERVAL_UNITS["w"] == 0 else 0
+        buckets = self.timestamps - (self.timestamps - offset) % interval
+        group = np.zeros(len(self), dtype=np.int64)
+        for codes, categories in self.labels.values():
+            group = group * max(len(categories), 1) + codes
+        # bucket first so the bars come out sorted by time
+        order = np.lexsort((self.timestamps, group, buckets))
+        buckets, group = buckets[order], group[order]
+        price = self.values["price"][order]
+
+        changed = (buckets[1:] != buckets[:-1]) | (group[1:] != group[:-1])
+        starts = np.flatnonzero(np.concatenate(([len(self) > 0], changed)))
+        ends = np.append(starts[1:], len(self))[:len(starts)] - 1
+        return ColumnStore(
+            CANDLE_LAYOUT,
+            buckets[starts],
+            {field: (codes[order][starts], categories) for field, (codes, categories) in self.labels.items()},
+            {
+                "open": price[starts],
+                "high": np.maximum.reduceat(price, starts) if len(starts) else price,
+                "low": np.minimum.reduceat(price, starts) if len(starts) else price,
+                "close": price[ends],
+                "volume": self.values["total_volume"][order][ends],
+            },
+        )
+
+    def since(self, after: datetime):
+        """Rows strictly newer than after."""
+        return self.take(slice(int(np.searchsorted(self.timestamps, to_epoch(after), side="right")), None))
+
+    def date_bounds(self, start_date: date = None, end_date: date = None):
+        return date_bounds(start_date, end_date)
+
+    def time_of_day_bounds(self, start_time: time = None, end_time: time = None):
+        first = from_epoch(self.timestamps[0]) if len(self) else None
+        return resolve_time_of_day(first, start_time), resolve_time_of_day(first, end_time)
+
+    def timestamp_strings(self):
+        strings = self.timestamps.astype("datetime64[s]").astype(str)
+        if self.layout.timestamp_separator != "T" and len(strings):
+            strings = np.char.replace(strings, "T", self.layout.timestamp_separator)
+        return strings.tolist()
+
+    def columns(self):
+        """Decoded columns as plain lists, keyed like the response schemas."""
+        columns = {self.layout.timestamp_field: self.timestamp_strings()}
+        for field in self.layout.label_fields:
+            codes, categories = self.labels[field]
+            columns[field] = np.array(categories, dtype=object)[codes].tolist()
+        for field in self.layout.value_fields:
+            columns[field] = self.values[field].tolist()
+        return columns
+
+    def to_rows_json(self):
+        """Row-of-objects JSON, byte compatible with the chart/ohlc schemas."""
+        columns = self.columns()
+        rows = [dict(zip(columns, row)) for row in zip(*columns.values())]
+        return json.dumps(rows, separators=(",", ":")).encode()
+
+
+def parse_interval(value: str):
+    """Seconds in an interval such as "15m", "4h", "1d" or "1w", ValueError for anything else."""
+    value = value.strip().lower()
+    if len(value) < 2 or value[-1] not in INTERVAL_UNITS or not value[:-1].isdigit():
+        raise ValueError(f"invalid interval: {value}")
+    seconds = int(value[:-1]) * INTERVAL_UNITS[value[-1]]
+    if not 0 < seconds <= MAX_INTERVAL:
+        raise ValueError(f"invalid interval: {value}")
+    return seconds
+
+
+def to_epoch(value: datetime):
+    return np.datetime64(naive_utc(value), "s").astype(np.int64)
+
+
+def from_epoch(value):
+    return np.datetime64(int(value), "s").item()
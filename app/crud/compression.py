@@ -0,0 +1,65 @@
+import gzip
+import brotli
+import zstandard
+
+# preferred first when the client accepts several with the same q-value
+ENCODINGS = ("br", "zstd", "gzip")
+
+# bodies under this size are cached and served as they are, like nginx gzip_min_length
+MIN_COMPRESS_BYTES = 1024
+
+_zstd_compressor = zstandard.ZstdCompressor(level=10)
+_zstd_decompressor = zstandard.ZstdDecompressor()
+
+
+def compress(body: bytes, encoding: str):
+    # high levels are affordable, each body is compressed once at cache-fill time
+    if encoding == "br":
+        return brotli.compress(body, quality=9)
+    if encoding == "zstd":
+        return _zstd_compressor.compress(body)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    return body
+
+
+def decompress(body: bytes, encoding: str):
+    if encoding == "br":
+        return brotli.decompress(body)
+    if encoding == "zstd":
+        return _zstd_decompressor.decompress(body)
+    if encoding == "gzip":
+        return gzip.decompress(body)
+    return body
+
+
+def compressed_variants(body: bytes):
+    """{encoding: body} worth caching for body, small bodies only as identity."""
+    if len(body) < MIN_COMPRESS_BYTES:
+        return {"identity": body}
+    return {encoding: compress(body, encoding) for encoding in ENCODINGS}
+
+
+def negotiate_encoding(accept_encoding: str):
+    """Best of ENCODINGS allowed by an Accept-Encoding header, else identity."""
+    if not accept_encoding:
+        return "identity"
+    weights = {}
+    for coding in accept_encoding.split(","):
+        name, _, params = coding.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+
+    best, best_q = "identity", 0.0
+    for encoding in ENCODINGS:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
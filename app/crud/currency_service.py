@@ -1,12 +1,13 @@
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from db import Currency
 from schemas.schemas import currency_schema
 
 class CurrencyService:
-    def __init__(self, session : Session):
+    def __init__(self, session : AsyncSession):
         self.session = session
 
-    def get_all_currencies(self):
+    async def get_all_currencies(self):
         statement = (
             select(
                 Currency.currency_key,
@@ -16,7 +17,7 @@ class CurrencyService:
                 Currency.is_active
             )
         )
-        results = self.session.exec(statement).all()
+        results = (await self.session.exec(statement)).all()
 
         return [
             currency_schema(
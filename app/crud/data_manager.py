@@ -1,120 +1,492 @@
-import json
 from .api_service import APIService
-from .redis_service import RedisService
+from .redis_service import RedisService, RateLimit, variant_key
 from .chart_service import ChartService
 from .ohlc_service import OhlcService
+from .column_store import ColumnStore, LAYOUTS, from_epoch
+from .formats import encode_store, record_fields, labelled_records, ndjson_chunk, csv_chunk, chart_list_adapter, ohlc_list_adapter
+from .compression import compress, decompress, compressed_variants
+from .indicators import indicator_tag, update_indicator, dump_indicator, load_indicator
+from .data_versions import data_versions, FACT_TABLES, table_name, version_prefix, version_watermark
+from .live_hub import live_message
+from .single_flight import single_flight
+from .prewarm import query_shapes, load_shape
+from .key_range import encode_cursor, to_keys, naive_utc
+from .key_name_filter import key_name_filter
+from core.config import settings
+from core.session import new_read_session, credential_cache
 from pydantic import ValidationError
+from sqlalchemy.exc import OperationalError, InterfaceError, TimeoutError as PoolTimeout
 from db import APIkey
+from datetime import datetime, timezone
+import asyncio
+import hashlib
 
+# page size for cursor requests that do not set a limit
+DEFAULT_PAGE_SIZE = 1000
+
+
+# keeps stale-while-revalidate refreshes referenced until they finish
+background_refreshes = set()
+
+
+def data_key(prefix: str, format: str, limit: int, start, end, since=None):
+    key = f"{prefix}{format}:{limit}:{start}:{end}"
+    # pollers share their since values, so delta bodies are worth caching too
+    return f"{key}:since={naive_utc(since).isoformat()}" if since else key
 
 
 class DataManager():
 
-    def __init__(self, session=None, redis_host=None):
-        self.r = RedisService(redis_host)
+    def __init__(self, session=None, redis_host=None, local_cache=None, redis_data=None, read_session=None):
+        # api_keys go to the primary, data reads to the replica session when given
+        read_session = read_session if read_session is not None else session
+        self.r = RedisService(redis_host, redis_data)
+        self.local_cache = local_cache
         self.api_service = APIService(session)
-        self.chart_service = ChartService(session)
-        self.ohlc_service = OhlcService(session)
+        self.chart_service = ChartService(read_session)
+        self.ohlc_service = OhlcService(read_session)
         self.redis = self.r.r
 
-    def authenticate_apikey(self, keyname_provided:str, provided_key: str):
-        if self.r.authenticate_apikey(keyname_provided, provided_key):
-            return True
-        else:
-            api_key = self.api_service.verify_apikey(provided_key, keyname_provided)
-            if api_key:
-                json_data = api_key.model_dump_json()
-                self.r.set_key(f"auth:{keyname_provided}", json_data, ex=300)
-                return True
-            else:
+    async def authenticate_apikey(self, keyname_provided:str, provided_key: str):
+        """Verify a credential that is not cached in Redis and cache the outcome there."""
+        # unknown names and wrong secrets are cached as failures, so retries never reach the DB
+        credential_key = f"credential:{keyname_provided}:{self.r.credential_digest(provided_key)}"
+        json_data = credential_cache.get(credential_key)
+        if json_data is None:
+            if settings.key_name_filter:
+                name_filter = key_name_filter()
+                if not await self.r.may_have_key_name(name_filter.key, name_filter.ready_bit, name_filter.positions(keyname_provided)):
+                    await self.r.cache_auth_failure(keyname_provided, ex=settings.auth_fail_ttl)
+                    return False
+            if not await self.api_service.keyname_exists(keyname_provided):
+                await self.r.cache_auth_failure(keyname_provided, ex=settings.auth_fail_ttl)
                 return False
+            # the row is in the session now, verify_apikey does not query again
+            api_key = await self.api_service.verify_apikey(provided_key, keyname_provided)
+            if not api_key:
+                await self.r.cache_auth_failure(keyname_provided, provided_key, ex=settings.auth_fail_ttl)
+                return False
+            json_data = api_key.model_dump_json()
+            credential_cache.set(credential_key, json_data)
+        await self.r.cache_apikey(keyname_provided, json_data, provided_key, ex=300)
+        return True
+
+    async def authorize_request(self, keyname_provided: str, provided_key: str, cost: int = 1):
+        limit = await self.r.consume_request(keyname_provided, provided_key, cost)
+        if limit.status == RedisService.AUTH_NOT_CACHED:
+            # cold cache: verify against the DB once, then retry the script
+            if not await self.authenticate_apikey(keyname_provided, provided_key):
+                return RateLimit(RedisService.AUTH_FAILED)
+            limit = await self.r.consume_request(keyname_provided, provided_key, cost)
+        if limit.status == RedisService.RATE_LIMITED:
+            await self.r.deactivate_key(keyname_provided)
+        return limit
     
-    def check_rate_limit(self, keyname_provided):
-        return self.r.check_rate_limit(keyname_provided)
-    
-    def increment_request_count(self, keyname_provided: str):
-        return self.r.increment_request_count(keyname_provided)
-    
-    def reset_daily_limit(self):
-        return self.r.reset_daily_limit()
-    
-    def get_chart(self,type : str, limit : int, start: str, end: str):
-        chart_data = self.r.cache_chart(type, limit, start, end)
-        if chart_data:
-            return chart_data
-        else:
-            redis_key = f"data:chart_{type}:{limit}:{start}:{end}"
-            
-            if type == "lastday":
-                data = self.chart_service.get_chart_lastday(limit, start, end)
-            elif type == "history":
-                data = self.chart_service.get_chart_history(limit, start, end)
-            
-            json_data = json.dumps([item.model_dump(mode='json') for item in data])
-            self.r.set_key(redis_key, json_data, ex=300)  # Cache for 5 minutes
-            return data
+    async def get_chart(self,type : str, limit : int, start: str, end: str, format: str = "json", encoding: str = "identity", since: datetime = None):
+        return await self.get_data("chart", type, limit, start, end, format, encoding, since)
         
-    def get_ohlc(self,type : str, limit : int, start: str, end: str):
-        ohlc_data = self.r.cache_ohlc(type, limit, start, end)
-        if ohlc_data:
-            return ohlc_data
+    async def get_ohlc(self,type : str, limit : int, start: str, end: str, format: str = "json", encoding: str = "identity", since: datetime = None):
+        return await self.get_data("ohlc", type, limit, start, end, format, encoding, since)
+
+    async def get_data(self, dataset: str, type: str, limit: int, start, end, format: str, encoding: str = "identity", since: datetime = None):
+        """Response body and its Content-Encoding, variants are compressed once per fill."""
+        if since is None:
+            # a delta is only asked for until the next load, not worth prewarming
+            query_shapes.record("data", dataset=dataset, type=type, limit=limit, start=start, end=end, format=format)
+        return await self.serve(self.data_request(dataset, type, limit, start, end, format, since), encoding)
+
+    async def fill_data(self, dataset: str, type: str, limit: int, start, end, format: str, encoding: str = "identity"):
+        return await self.fill_request(self.data_request(dataset, type, limit, start, end, format), encoding)
+
+    def data_request(self, dataset: str, type: str, limit: int, start, end, format: str, since: datetime = None):
+        # (dataset, type, key suffix, build) as taken by serve and fill_request
+        return dataset, type, data_key("", format, limit, start, end, since), \
+            lambda dm: dm.build_data(dataset, type, limit, start, end, format, since)
+
+    async def build_data(self, dataset: str, type: str, limit: int, start, end, format: str, since: datetime = None):
+        store = await self.get_store(dataset, type)
+        return encode_store(self.store_window(store, type, start, end, limit, since), format)
+
+    async def get_batch(self, queries: list, format: str, encoding: str = "identity"):
+        """Several chart/ohlc queries answered as one JSON array body."""
+        for q in queries:
+            query_shapes.record("data", dataset=q.dataset, type=q.type, limit=q.limit, start=q.start, end=q.end, format=format)
+        redis_keys = [
+            data_key(await self.table_prefix(q.dataset, q.type), format, q.limit, q.start, q.end) for q in queries
+        ]
+        # the sub-query keys carry the table versions, so does the hash of them
+        batch_key = "data:batch:" + hashlib.sha256("|".join(redis_keys).encode()).hexdigest()
+        cached = await self.get_cached_body(batch_key, encoding)
+        if cached:
+            return cached
+
+        bodies = await self.get_cached_bodies(redis_keys)
+        missing = [i for i, body in enumerate(bodies) if body is None]
+        filled = await asyncio.gather(*(self.fill_detached(queries[i], format) for i in missing))
+        for i, body in zip(missing, filled):
+            bodies[i] = body
+        # old versions are not swept by prefix, the short expiry cleans them up
+        return await self.cache_body(batch_key, b"[" + b",".join(bodies) + b"]", encoding, ex=300)
+
+    async def fill_detached(self, query, format: str):
+        # an AsyncSession cannot run queries concurrently, so every fill gets its own
+        async with new_read_session() as session:
+            data_manager = DataManager(redis_host=self.redis, local_cache=self.local_cache, redis_data=self.r.data, read_session=session)
+            body, _ = await data_manager.fill_data(query.dataset, query.type, query.limit, query.start, query.end, format)
+            return body
+
+    async def get_candles(self, type: str, interval: int, limit: int, start, end, format: str = "json", encoding: str = "identity"):
+        """OHLC+volume bars resampled from the chart store, cached like any other data response."""
+        query_shapes.record("candles", type=type, interval=interval, limit=limit, start=start, end=end, format=format)
+        return await self.serve(self.candles_request(type, interval, limit, start, end, format), encoding)
+
+    def candles_request(self, type: str, interval: int, limit: int, start, end, format: str):
+        return "chart", type, data_key(f"candles_{interval}:", format, limit, start, end), \
+            lambda dm: dm.build_candles(type, interval, limit, start, end, format)
+
+    async def build_candles(self, type: str, interval: int, limit: int, start, end, format: str):
+        store = await self.get_store("chart", type)
+        candles = store.slice(*self.store_bounds(store, type, start, end)).resample(interval)
+        return encode_store(candles.slice(limit=limit), format)
+
+    async def get_indicator(self, dataset: str, type: str, name: str, period: int, width: float,
+                            limit: int, start, end, format: str = "json", encoding: str = "identity"):
+        query_shapes.record("indicator", dataset=dataset, type=type, name=name, period=period, width=width,
+                            limit=limit, start=start, end=end, format=format)
+        return await self.serve(self.indicator_request(dataset, type, name, period, width, limit, start, end, format), encoding)
+
+    def indicator_request(self, dataset: str, type: str, name: str, period: int, width: float,
+                          limit: int, start, end, format: str):
+        suffix = data_key(f"indicator_{indicator_tag(name, period, width)}:", format, limit, start, end)
+        return dataset, type, suffix, \
+            lambda dm: dm.build_indicator(dataset, type, name, period, width, limit, start, end, format)
+
+    async def build_indicator(self, dataset: str, type: str, name: str, period: int, width: float,
+                              limit: int, start, end, format: str):
+        series = await self.get_indicator_series(dataset, type, name, period, width)
+        return encode_store(series.slice(*self.store_bounds(series, type, start, end), limit), format)
+
+    async def get_indicator_series(self, dataset: str, type: str, name: str, period: int, width: float):
+        """Whole indicator series for the current store, shared by every window."""
+        # kept outside data:* so table refreshes keep it, only the points added since are computed
+        series_key = f"indicator:{dataset}_{type}_{indicator_tag(name, period, width)}"
+        store = await self.get_store(dataset, type)
+        cached = self.local_cache.get(series_key)
+        if cached is None:
+            raw_series = await self.r.get_data(series_key)
+            if raw_series:
+                cached = load_indicator(store.layout, name, decompress(raw_series, "zstd"))
+        series, state = cached if cached is not None else (None, None)
+
+        series, state, changed = update_indicator(dataset, name, period, width, store, series, state)
+        if changed:
+            await self.r.set_data(series_key, compress(dump_indicator(series, state), "zstd"), ex=86400)
+        self.local_cache.set(series_key, (series, state), size=series.nbytes)
+        return series
+
+    async def serve(self, request: tuple, encoding: str):
+        """Body cached for request under the current version of its table."""
+        # request is (dataset, type, key suffix, build); right after a version change the previous
+        # version's entry is served for its grace window while one background refresh fills the new one
+        dataset, type, suffix, build = request
+        redis_key = await self.table_prefix(dataset, type) + suffix
+        cached = await self.get_cached_body(redis_key, encoding)
+        if cached:
+            return cached
+        previous = await data_versions.get_previous(self.r, dataset, type)
+        if previous:
+            stale = await self.get_cached_body(version_prefix(dataset, type, previous) + suffix, encoding)
+            if stale:
+                self.refresh_in_background(redis_key, build)
+                return stale
+        return await self.fill_body(redis_key, encoding, build)
+
+    async def fill_request(self, request: tuple, encoding: str = "identity"):
+        dataset, type, suffix, build = request
+        return await self.fill_body(await self.table_prefix(dataset, type) + suffix, encoding, build)
+
+    async def fill_body(self, redis_key: str, encoding: str, build):
+        async def fill():
+            return await self.store_variants(redis_key, await build(self))
+        # concurrent misses share one build, each picks its own encoding from it
+        return self.pick_variant(redis_key, await single_flight.do(redis_key, fill), encoding)
+
+    def refresh_in_background(self, redis_key: str, build):
+        if single_flight.running(redis_key):
+            return
+        task = asyncio.create_task(self.refresh_detached(redis_key, build))
+        background_refreshes.add(task)
+        task.add_done_callback(background_refreshes.discard)
+
+    async def refresh_detached(self, redis_key: str, build):
+        # outlives the request, so it cannot use the request session
+        try:
+            async with new_read_session() as session:
+                data_manager = DataManager(redis_host=self.redis, local_cache=self.local_cache, redis_data=self.r.data, read_session=session)
+                await data_manager.fill_body(redis_key, "identity", build)
+        except Exception as e:
+            print(f"Background refresh of {redis_key} failed: {e}")
+
+    async def store_variants(self, redis_key: str, body: bytes, ex: int = None):
+        variants = compressed_variants(body)
+        await self.r.set_variants(redis_key, variants, ex=ex or settings.data_cache_ttl)
+        return body, variants
+
+    def pick_variant(self, redis_key: str, filled: tuple, encoding: str):
+        body, variants = filled
+        if encoding in variants:
+            body = variants[encoding]
         else:
-            redis_key = f"data:ohlc_{type}:{limit}:{start}:{end}"            
-            if type == "lastday":
-                data = self.ohlc_service.get_ohlc_lastday(limit, start, end)
-            elif type == "history":
-                data = self.ohlc_service.get_ohlc_history(limit, start, end)
-            
-            json_data = json.dumps([item.model_dump() for item in data])
-            self.r.set_key(redis_key, json_data, ex=300)  # Cache for 5 minutes
-            return data
-        
-    
-    def update_lastrequest_date(self, key_name: str):
-        return self.r.update_lastrequest_date(key_name)
+            encoding = "identity"
+        self.local_cache.set(variant_key(redis_key, encoding), (body, encoding), size=len(body))
+        return body, encoding
+
+    async def cache_body(self, redis_key: str, body: bytes, encoding: str, ex: int = None):
+        return self.pick_variant(redis_key, await self.store_variants(redis_key, body, ex), encoding)
+
+    async def get_store(self, dataset: str, type: str):
+        """Whole fact table as a ColumnStore, loaded once per table version and sliced per request."""
+        # callers in this process share one load, other workers wait on a Redis lock for it
+        table_key = f"{await self.table_prefix(dataset, type)}table"
+        store = self.local_cache.get(table_key)
+        if store is not None:
+            return store
+        return await single_flight.do(table_key, lambda: self.load_store(dataset, type, table_key))
+
+    async def load_store(self, dataset: str, type: str, table_key: str):
+        raw_table = await self.r.get_data(table_key)
+        while raw_table is None:
+            token = await self.r.acquire_lock(table_key, settings.fill_lock_seconds)
+            if token:
+                try:
+                    # the previous holder may have finished between our miss and the lock
+                    raw_table = await self.r.get_data(table_key)
+                    if raw_table is None:
+                        store = await self.query_store(dataset, type)
+                        await self.r.set_data(table_key, compress(store.to_json().encode(), "zstd"), ex=settings.data_cache_ttl)
+                        self.local_cache.set(table_key, store, size=store.nbytes)
+                        return store
+                finally:
+                    await self.r.release_lock(table_key, token)
+            else:
+                raw_table = await self.r.wait_for_data(table_key, settings.fill_lock_seconds)
+
+        store = ColumnStore.from_json(LAYOUTS[dataset], decompress(raw_table, "zstd"))
+        self.local_cache.set(table_key, store, size=store.nbytes)
+        return store
+
+    async def query_store(self, dataset: str, type: str):
+        if dataset == "chart":
+            return await self.chart_service.get_chart_store(type)
+        return await self.ohlc_service.get_ohlc_store(type)
+
+    async def get_page(self, dataset: str, after: tuple, end, limit: int):
+        """History page after a decoded cursor, plus the cursor of the next page when this one is full."""
+        page_size = limit if limit else DEFAULT_PAGE_SIZE
+        if dataset == "chart":
+            data = await self.chart_service.get_chart_page(after, end, page_size)
+            body = chart_list_adapter.dump_json(data)
+            last = data[-1].bitcoin_date if data else None
+        else:
+            data = await self.ohlc_service.get_ohlc_page(after, end, page_size)
+            body = ohlc_list_adapter.dump_json(data)
+            last = datetime.fromisoformat(data[-1].timestamp) if data else None
+
+        next_cursor = encode_cursor(*to_keys(last)) if len(data) == page_size else None
+        return body, next_cursor
+
+    async def next_cursor(self, dataset: str, type: str, limit: int, start, end, since: datetime = None):
+        """Cursor following a limited first page, worked out on the cached store."""
+        if not limit:
+            return None
+        store = await self.get_store(dataset, type)
+        page = self.store_window(store, type, start, end, limit, since)
+        if len(page) < limit:
+            return None
+        return encode_cursor(*to_keys(from_epoch(page.timestamps[-1])))
+
+    async def stream_history(self, dataset: str, limit: int, start, end, format: str, since: datetime = None):
+        """NDJSON or CSV chunks of a history range, one per cursor batch so memory stays flat."""
+        layout = LAYOUTS[dataset]
+        fields = record_fields(layout)
+        if dataset == "chart":
+            batches = self.chart_service.stream_chart_history(limit, start, end, since)
+        else:
+            batches = self.ohlc_service.stream_ohlc_history(limit, start, end, since)
+
+        if format == "csv":
+            yield csv_chunk([fields])
+        async for batch in batches:
+            records = labelled_records(layout, batch)
+            if format == "ndjson":
+                yield ndjson_chunk(fields, records)
+            else:
+                yield csv_chunk(records)
+
+    def store_window(self, store: ColumnStore, type: str, start, end, limit: int, since: datetime = None):
+        """Rows in the start/end window, newer than since when given, at most limit of them."""
+        bounds = self.store_bounds(store, type, start, end)
+        if since is None:
+            return store.slice(*bounds, limit)
+        return store.slice(*bounds).since(since).slice(limit=limit)
+
+    def store_bounds(self, store: ColumnStore, type: str, start, end):
+        if type == "lastday":
+            return store.time_of_day_bounds(start, end)
+        return store.date_bounds(start, end)
+
+    async def get_cached_bodies(self, redis_keys: list):
+        """Identity bodies for redis_keys, None where nothing is cached."""
+        bodies = [self.local_cache.get(key) for key in redis_keys]
+        missing = [i for i, cached in enumerate(bodies) if cached is None]
+        if missing:
+            found = await self.r.get_variants([redis_keys[i] for i in missing], "identity")
+            for i, cached in zip(missing, found):
+                if cached:
+                    body, content_encoding = cached
+                    bodies[i] = decompress(body, content_encoding), "identity"
+                    self.local_cache.set(redis_keys[i], bodies[i], size=len(bodies[i][0]))
+        return [cached[0] if cached else None for cached in bodies]
+
+    async def get_cached_body(self, redis_key: str, encoding: str):
+        # L1 first: hot keys are answered without touching the network
+        cache_key = variant_key(redis_key, encoding)
+        cached = self.local_cache.get(cache_key)
+        if cached is None:
+            cached = await self.r.get_variant(redis_key, encoding)
+            if cached:
+                body, content_encoding = cached
+                if content_encoding != encoding and encoding == "identity":
+                    # large entries are only kept compressed, zstd is the fastest to undo
+                    cached = decompress(body, content_encoding), "identity"
+                self.local_cache.set(cache_key, cached, size=len(cached[0]))
+        return cached
+
+    async def table_prefix(self, dataset: str, type: str):
+        return version_prefix(dataset, type, await data_versions.get(self.r, dataset, type))
+
+    async def refresh_data_versions(self):
+        """Retire the cache of the fact tables whose watermark changed and return them."""
+        # read the versions again from Redis on every probe: an invalidation
+        # message lost while the listener reconnected would otherwise leave
+        # this worker on an old version, its own SET ... GET sees no change
+        data_versions.invalidate()
+        changed = []
+        for dataset, type in FACT_TABLES:
+            if dataset == "chart":
+                version = await self.chart_service.get_chart_version(type)
+            else:
+                version = await self.ohlc_service.get_ohlc_version(type)
+            name = table_name(dataset, type)
+            previous = await self.r.swap_data_version(name, version)
+            if previous != version:
+                previous = previous or "0"
+                # the old entries stay readable for the grace window, then expire
+                await self.r.set_previous_version(name, previous, settings.stale_grace_seconds)
+                data_versions.set(dataset, type, version, previous)
+                await self.retire_data_cache(version_prefix(dataset, type, previous))
+                changed.append((dataset, type))
+        return changed
+
+    async def prewarm(self, tables: list):
+        """Fill the most requested query shapes of the tables that just got new data."""
+        requests = {"data": self.data_request, "candles": self.candles_request, "indicator": self.indicator_request}
+        warmed = 0
+        for raw_shape in await self.r.top_query_shapes(settings.prewarm_top_n):
+            kind, params = load_shape(raw_shape)
+            if (params.get("dataset", "chart"), params["type"]) not in tables:
+                continue
+            try:
+                await self.fill_request(requests[kind](**params))
+                warmed += 1
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Skipping query shape {raw_shape}: {e}")
+        return warmed
+
+    async def publish_live(self, tables: list):
+        """Publish the points a load added to the lastday tables for every worker to fan out."""
+        published = 0
+        for dataset, type in tables:
+            if type != "lastday":
+                continue
+            watermark = version_watermark(await data_versions.get_previous(self.r, dataset, type))
+            if watermark is None:
+                continue
+            store = await self.get_store(dataset, type)
+            points = store.since(watermark)
+            if len(points):
+                await self.r.publish_live(dataset, live_message(dataset, points))
+                published += len(points)
+        return published
+
+    async def flush_query_shapes(self):
+        counts = query_shapes.drain()
+        if counts:
+            await self.r.flush_query_shapes(counts, settings.prewarm_flush_seconds)
+
+    async def retire_data_cache(self, prefix: str):
+        self.local_cache.invalidate(prefix)
+        await self.r.expire_data(prefix, settings.stale_grace_seconds)
+        await self.r.publish_invalidation(prefix)
+
+    async def invalidate_data_cache(self, prefix: str = "data:"):
+        self.local_cache.invalidate(prefix)
+        await self.r.delete_data(prefix)
+        await self.r.publish_invalidation(prefix)
     
-    def refresh_db_apicash(self):
-        # 1. Collect all keys
-        keys = list(self.redis.scan_iter("auth:*"))
-        if not keys:
+    async def refresh_db_apicash(self):
+        """Write the usage of the keys used since the last sync to the DB in one bulk UPDATE."""
+        names = await self.r.drain_dirty_keys()
+        if not names:
             return True
-        print("keys:", keys)
-        # 2. Pipeline all GET requests (Auth objects and Usage counts)
-        with self.redis.pipeline() as pipe:
-            for key in keys:
-                pipe.get(key)
-                # Derive the usage key from the auth key (auth:name -> usage:name)
-                name = key.split(":", 1)[1]
-                pipe.get(f"usage:{name}")
-            
-            # results will be [auth1, usage1, auth2, usage2, ...]
-            results = pipe.execute()
-        # 3. Process the results in pairs
-        for i in range(0, len(results), 2):
-            raw_auth = results[i]
-            raw_usage = results[i+1]
-
-            if raw_auth:
-                try:
-                    api_key_obj = APIkey.model_validate_json(raw_auth)
-                    
-                    # Default to 0 if usage key doesn't exist in Redis yet
-                    usage_count = int(raw_usage) if raw_usage else 0
-                    # 4. Sync to Database
-                    print(self.api_service.update_api_key(
-                        key_name=api_key_obj.key_name,
-                        is_active=api_key_obj.is_active,
-                        requests_made_today=usage_count,
-                        last_request_date=api_key_obj.last_request_date
-                    ))
-                except (ValidationError, ValueError) as e:
-                    # Log the error but continue with other keys
-                    print(f"Error processing key {keys[i//2]}: {e}")
-                    # continue
+        rows = []
+        for name, (raw_auth, raw_usage, raw_last_request) in zip(names, await self.r.get_usage(names)):
+            row = {"key_name": name, "requests_made_today": int(raw_usage) if raw_usage else 0}
+            try:
+                if raw_last_request:
+                    # stamped in UTC, stored naive like the other datetime columns
+                    row["last_request_date"] = datetime.fromisoformat(raw_last_request).astimezone(timezone.utc).replace(tzinfo=None)
+                # the auth entry expires sooner than the usage, keep is_active as is without it
+                if raw_auth:
+                    row["is_active"] = APIkey.model_validate_json(raw_auth).is_active
+            except (ValidationError, ValueError) as e:
+                # Log the error but still write the usage count
+                print(f"Error processing key {name}: {e}")
+            rows.append(row)
+        try:
+            await self.api_service.update_api_keys(rows)
+        except (OperationalError, InterfaceError, PoolTimeout):
+            # the DB was unreachable, retried with the next sync
+            await self.r.mark_dirty(names)
+            raise
+        print(f"Synchronized {len(rows)} API keys.")
         return True
 
     
     
-    def generate_apikey(self, response_model):
-        return self.api_service.create_api_key(response_model)
+    async def generate_apikey(self, response_model):
+        new_key = await self.api_service.create_api_key(response_model)
+        if new_key:
+            await self.r.clear_auth_failure(new_key.key_name)
+            if settings.key_name_filter:
+                name_filter = key_name_filter()
+                await self.r.add_key_names(name_filter.key, name_filter.positions(new_key.key_name))
+        return new_key
+
+    async def build_key_name_filter(self):
+        """Add every existing key name to the filter once, then mark it ready."""
+        # generate_apikey adds names created meanwhile, until ready every name passes
+        name_filter = key_name_filter()
+        if await self.r.key_name_filter_ready(name_filter.key, name_filter.ready_bit):
+            return False
+        token = await self.r.acquire_lock(name_filter.key, ex=settings.fill_lock_seconds)
+        if token is None:
+            return False
+        try:
+            async for names in self.api_service.stream_key_names():
+                await self.r.add_key_names(name_filter.key, [position for name in names for position in name_filter.positions(name)])
+            await self.r.set_key_name_filter_ready(name_filter.key, name_filter.ready_bit)
+            return True
+        finally:
+            await self.r.release_lock(name_filter.key, token)
 
@@ -0,0 +1,54 @@
+from .key_range import from_keys
+
+# (dataset, type) of every fact table the data cache is built from
+FACT_TABLES = (("chart", "history"), ("chart", "lastday"), ("ohlc", "history"), ("ohlc", "lastday"))
+
+
+def table_name(dataset: str, type: str):
+    return f"{dataset}_{type}"
+
+
+def version_prefix(dataset: str, type: str, version: str):
+    """Start of every data:* key of this table version, so one prefix drops them all."""
+    return f"data:{table_name(dataset, type)}@{version}:"
+
+
+def version_watermark(version: str):
+    """Newest timestamp a version string was taken at, None for an empty table."""
+    if not version or version == "0":
+        return None
+    return from_keys(version[:8], version[8:12])
+
+
+class DataVersions:
+    """In-process copy of the data_version:{table} watermarks held in Redis."""
+    # dropped on every invalidation message and version probe and read again with one MGET,
+    # the previous version is kept for the stale grace window
+
+    def __init__(self):
+        self.versions = {}  # table -> (current, previous)
+
+    def invalidate(self):
+        self.versions = {}
+
+    def set(self, dataset: str, type: str, version: str, previous: str = None):
+        self.versions[table_name(dataset, type)] = (version, previous)
+
+    async def load(self, redis_service, dataset: str, type: str):
+        name = table_name(dataset, type)
+        if name not in self.versions:
+            names = [table_name(*table) for table in FACT_TABLES]
+            self.versions.update(zip(names, await redis_service.get_data_versions(names)))
+        return self.versions[name]
+
+    async def get(self, redis_service, dataset: str, type: str):
+        current, _ = await self.load(redis_service, dataset, type)
+        # not probed yet: "0" until the first watermark is published
+        return current or "0"
+
+    async def get_previous(self, redis_service, dataset: str, type: str):
+        _, previous = await self.load(redis_service, dataset, type)
+        return previous
+
+
+data_versions = DataVersions()
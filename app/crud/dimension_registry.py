@@ -0,0 +1,92 @@
+import asyncio
+import time as clock
+from datetime import datetime, time
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db import Date, Time
+from core.config import settings
+from .coin_service import CoinService
+from .currency_service import CurrencyService
+from .column_store import ColumnStore, StoreLayout
+
+
+class DimensionRegistry:
+    """In-process copy of the coin, currency, date and time dimensions, so fact queries skip the joins."""
+    # reloaded after refresh_seconds, on an unknown key, or by invalidate() on a version bump
+
+    def __init__(self, refresh_seconds: int):
+        self.refresh_seconds = refresh_seconds
+        self.coins = {}       # coin_key -> coin_id
+        self.currencies = {}  # currency_key -> currency_code
+        self.dates = {}       # date_key -> full_date
+        self.times = {}       # time_key -> time of day
+        self.loaded_at = None
+        self._lock = asyncio.Lock()
+
+    async def load(self, session: AsyncSession):
+        coins = await CoinService(session).get_all_coins()
+        currencies = await CurrencyService(session).get_all_currencies()
+        dates = (await session.exec(select(Date.date_key, Date.full_date))).all()
+        times = (await session.exec(select(Time.time_key, Time.time_of_day))).all()
+
+        self.coins = {coin.coin_key: coin.coin_id for coin in coins}
+        self.currencies = {currency.currency_key: currency.currency_code for currency in currencies}
+        self.dates = {row.date_key: row.full_date for row in dates}
+        self.times = {row.time_key: time.fromisoformat(row.time_of_day) for row in times}
+        self.loaded_at = clock.monotonic()
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    async def ensure(self, session: AsyncSession, rows=()):
+        if not self._needs_load(rows):
+            return
+        async with self._lock:
+            # another request may have reloaded while we waited
+            if self._needs_load(rows):
+                await self.load(session)
+
+    def _needs_load(self, rows):
+        if self.loaded_at is None or clock.monotonic() - self.loaded_at > self.refresh_seconds:
+            return True
+        return any(not self.knows(row) for row in rows)
+
+    def knows(self, row):
+        return (
+            row.date_key in self.dates
+            and row.time_key in self.times
+            and row.coin_key in self.coins
+            and row.currency_key in self.currencies
+        )
+
+    def timestamp(self, row):
+        return datetime.combine(self.dates[row.date_key], self.times[row.time_key])
+
+    async def label_rows(self, session: AsyncSession, rows):
+        """(timestamp, coin_name, currency_name, row) per fact row, dropping rows with unknown keys."""
+        await self.ensure(session, rows)
+        return self.labels(rows)
+
+    def labels(self, rows):
+        # no reload here, used while a streaming cursor holds the connection
+        return [
+            (self.timestamp(row), self.coins[row.coin_key], self.currencies[row.currency_key], row)
+            for row in rows
+            if self.knows(row)
+        ]
+
+    async def build_store(self, session: AsyncSession, layout: StoreLayout, rows):
+        await self.ensure(session, rows)
+        rows = [row for row in rows if self.knows(row)]
+        return ColumnStore.from_columns(
+            layout,
+            [self.timestamp(row) for row in rows],
+            {
+                "coin_name": [self.coins[row.coin_key] for row in rows],
+                "currency_name": [self.currencies[row.currency_key] for row in rows],
+            },
+            {field: [getattr(row, field) for row in rows] for field in layout.value_fields},
+        )
+
+
+dimension_registry = DimensionRegistry(settings.dimension_refresh_seconds)
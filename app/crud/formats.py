@@ -0,0 +1,101 @@
+import csv
+import io
+import json
+import msgpack
+import pyarrow as pa
+from pydantic import TypeAdapter
+from schemas.schemas import chart_schema, ohlc_schema
+from .column_store import ColumnStore, StoreLayout
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "columnar": "application/json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Accept header values understood on top of the format= parameter
+ACCEPT_FORMATS = {
+    "application/json": "json",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/x-ndjson": "ndjson",
+    "text/csv": "csv",
+}
+
+# formats served from the cached store, the others are streamed
+STORE_FORMATS = ("json", "columnar", "msgpack", "arrow")
+
+chart_list_adapter = TypeAdapter(list[chart_schema])
+ohlc_list_adapter = TypeAdapter(list[ohlc_schema])
+
+
+def negotiate(format: str, accept: str, allowed: tuple):
+    """Response format from format= or else the Accept header, None when nothing fits."""
+    if format:
+        return format if format in allowed else None
+    if not accept:
+        return "json"
+    for media_range in accept.split(","):
+        media_type = media_range.split(";")[0].strip().lower()
+        if media_type in ("*/*", "application/*"):
+            return "json"
+        candidate = ACCEPT_FORMATS.get(media_type)
+        if candidate in allowed:
+            return candidate
+    return None
+
+
+def encode_store(store: ColumnStore, format: str):
+    if format == "columnar":
+        return json.dumps(store.columns(), separators=(",", ":")).encode()
+    if format == "msgpack":
+        return msgpack.packb(store.columns())
+    if format == "arrow":
+        return arrow_ipc(store)
+    return store.to_rows_json()
+
+
+def arrow_ipc(store: ColumnStore):
+    # values and label codes go to Arrow without copying the NumPy buffers
+    columns = {store.layout.timestamp_field: pa.array(store.timestamps, type=pa.timestamp("s"))}
+    for field, (codes, categories) in store.labels.items():
+        columns[field] = pa.DictionaryArray.from_arrays(pa.array(codes), pa.array(categories, type=pa.string()))
+    for field, column in store.values.items():
+        columns[field] = pa.array(column)
+    table = pa.table(columns)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def record_fields(layout: StoreLayout):
+    return (layout.timestamp_field, *layout.label_fields, *layout.value_fields)
+
+
+def labelled_records(layout: StoreLayout, labelled_rows):
+    # same values and timestamp format as chart_schema/ohlc_schema
+    for timestamp, coin_name, currency_name, row in labelled_rows:
+        yield (
+            timestamp.isoformat(layout.timestamp_separator),
+            coin_name,
+            currency_name,
+            *(getattr(row, field) for field in layout.value_fields),
+        )
+
+
+def ndjson_chunk(fields: tuple, records):
+    return "".join(
+        json.dumps(dict(zip(fields, record)), separators=(",", ":")) + "\n"
+        for record in records
+    )
+
+
+def csv_chunk(records):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(records)
+    return buffer.getvalue()
@@ -0,0 +1,169 @@
+import json
+
+import numpy as np
+
+from .column_store import ColumnStore, StoreLayout
+
+# outputs of each indicator, in response column order
+INDICATOR_FIELDS = {
+    "sma": ("sma",),
+    "ema": ("ema",),
+    "rsi": ("rsi",),
+    "vwap": ("vwap",),
+    "bollinger": ("middle", "upper", "lower"),
+}
+
+# series each dataset feeds the indicators with
+PRICE_FIELDS = {"chart": "price", "ohlc": "close"}
+
+
+def indicator_layout(source: StoreLayout, name: str):
+    # same timestamp field and format as the source rows so clients can join them
+    return StoreLayout(source.timestamp_field, source.timestamp_separator, (), INDICATOR_FIELDS[name])
+
+
+def indicator_tag(name: str, period: int, width: float):
+    if name == "bollinger":
+        return f"{name}_{period}_{width}"
+    return f"{name}_{period}"
+
+
+def rolling_sum(values: np.ndarray, window: int):
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        total = np.cumsum(np.concatenate(([0.0], values)))
+        out[window - 1:] = total[window:] - total[:-window]
+    return out
+
+
+def ewm(values: np.ndarray, alpha: float, previous: float = None):
+    """y[t] = (1 - alpha) * y[t-1] + alpha * x[t], seeded with previous or x[0]."""
+    # closed form per block, the block length keeps decay ** -k inside float64 range
+    out = np.empty(len(values))
+    if not len(values):
+        return out
+    decay = 1.0 - alpha
+    if previous is None:
+        previous = values[0]
+    block = max(1, int(600 / -np.log(decay)))
+    for lo in range(0, len(values), block):
+        chunk = values[lo:lo + block]
+        powers = decay ** np.arange(1, len(chunk) + 1)
+        out[lo:lo + len(chunk)] = powers * (previous + np.cumsum(alpha * chunk / powers))
+        previous = out[lo + len(chunk) - 1]
+    return out
+
+
+def sma(prices, volumes, period, width, state):
+    return {"sma": rolling_sum(prices, period) / period}, state
+
+
+def ema(prices, volumes, period, width, state):
+    out = ewm(prices, 2.0 / (period + 1), state.get("ema"))
+    if len(out):
+        state = {"ema": float(out[-1])}
+    return {"ema": out}, state
+
+
+def rsi(prices, volumes, period, width, state):
+    # Wilder smoothing seeded with the mean of the first period changes;
+    # prices[0] is the point before the first change
+    change = np.diff(prices)
+    gain, loss = np.clip(change, 0, None), np.clip(-change, 0, None)
+    avg_gain, avg_loss = np.full(len(change), np.nan), np.full(len(change), np.nan)
+    seen = state.get("seen", 0)
+    if not len(change):
+        return {"rsi": np.full(len(prices), np.nan)}, state
+    start = 0
+    if seen < period:
+        # still summing the first period changes
+        start = min(period - seen, len(change))
+        gain_sum = state.get("gain_sum", 0.0) + float(gain[:start].sum())
+        loss_sum = state.get("loss_sum", 0.0) + float(loss[:start].sum())
+        if seen + start < period:
+            state = {"gain_sum": gain_sum, "loss_sum": loss_sum, "seen": seen + start}
+            return {"rsi": np.full(len(prices), np.nan)}, state
+        avg_gain[start - 1], avg_loss[start - 1] = gain_sum / period, loss_sum / period
+        state = {"avg_gain": gain_sum / period, "avg_loss": loss_sum / period}
+    avg_gain[start:] = ewm(gain[start:], 1.0 / period, state["avg_gain"])
+    avg_loss[start:] = ewm(loss[start:], 1.0 / period, state["avg_loss"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    out = np.where(avg_loss == 0, np.where(avg_gain == 0, 50.0, 100.0), out)
+    state = {"avg_gain": float(avg_gain[-1]), "avg_loss": float(avg_loss[-1]), "seen": seen + len(change)}
+    return {"rsi": np.concatenate(([np.nan], out))}, state
+
+
+def vwap(prices, volumes, period, width, state):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {"vwap": rolling_sum(prices * volumes, period) / rolling_sum(volumes, period)}, state
+
+
+def bollinger(prices, volumes, period, width, state):
+    middle = rolling_sum(prices, period) / period
+    deviation = np.full(len(prices), np.nan)
+    if len(prices) >= period:
+        deviation[period - 1:] = np.lib.stride_tricks.sliding_window_view(prices, period).std(axis=1)
+    return {"middle": middle, "upper": middle + width * deviation, "lower": middle - width * deviation}, state
+
+
+# indicator -> (function, points before the first new one it has to see again)
+INDICATORS = {
+    "sma": (sma, lambda period: period - 1),
+    "ema": (ema, lambda period: 0),
+    "rsi": (rsi, lambda period: 1),
+    "vwap": (vwap, lambda period: period - 1),
+    "bollinger": (bollinger, lambda period: period - 1),
+}
+
+
+def update_indicator(dataset: str, name: str, period: int, width: float, store: ColumnStore,
+                     series: ColumnStore = None, state: dict = None):
+    """Extend series with the store points after its last timestamp, returns (series, state, changed)."""
+    # recursive indicators carry their state; a series that no longer lines up is recomputed
+    if name == "vwap" and "total_volume" not in store.values:
+        raise ValueError("vwap needs volumes, only the chart series has them")
+    function, lookback = INDICATORS[name]
+    layout = indicator_layout(store.layout, name)
+    empty = ColumnStore(layout, np.zeros(0, dtype=np.int64), {}, {field: np.zeros(0) for field in layout.value_fields})
+    if not len(store):
+        return empty, {}, series is None or len(series) > 0
+
+    new_from = 0
+    if series is not None and len(series):
+        last = series.timestamps[-1]
+        new_from = int(np.searchsorted(store.timestamps, last, side="right"))
+        if new_from == 0 or store.timestamps[new_from - 1] != last:
+            new_from = 0
+    if new_from == 0:
+        series, state = empty, {}
+
+    # rows that fell off the front of a rolling table go too
+    kept = series.take(slice(int(np.searchsorted(series.timestamps, store.timestamps[0], side="left")), None))
+    if new_from == len(store):
+        return kept, state, len(kept) != len(series)
+
+    lo = max(new_from - lookback(period), 0)
+    prices = store.values[PRICE_FIELDS[dataset]][lo:]
+    volumes = store.values["total_volume"][lo:] if name == "vwap" else None
+    outputs, state = function(prices, volumes, period, width, state)
+
+    timestamps = store.timestamps[new_from:]
+    outputs = {field: outputs[field][new_from - lo:] for field in layout.value_fields}
+    # warm-up points have no value yet and are left out
+    ready = ~np.isnan(np.column_stack(list(outputs.values()))).any(axis=1)
+    return ColumnStore(
+        layout,
+        np.concatenate((kept.timestamps, timestamps[ready])),
+        {},
+        {field: np.concatenate((kept.values[field], outputs[field][ready])) for field in layout.value_fields},
+    ), state, True
+
+
+def dump_indicator(series: ColumnStore, state: dict):
+    return json.dumps({"series": series.to_json(), "state": state}, separators=(",", ":")).encode()
+
+
+def load_indicator(source: StoreLayout, name: str, raw):
+    data = json.loads(raw)
+    return ColumnStore.from_json(indicator_layout(source, name), data["series"]), data["state"]
@@ -0,0 +1,32 @@
+import hashlib
+from typing import NamedTuple
+
+from core.config import settings
+
+
+class KeyNameFilter(NamedTuple):
+    """Layout of the Bloom filter of existing key names in a Redis bitmap."""
+    bits: int
+    hashes: int
+
+    @property
+    def key(self):
+        # a filter built with other settings lives under another key and is never read
+        return f"key_names:bloom:{self.bits}:{self.hashes}"
+
+    @property
+    def ready_bit(self):
+        # set once every existing name is in, inside the bitmap itself: an
+        # evicted bitmap, or one recreated by a single SETBIT, reads as not built
+        return self.bits
+
+    def positions(self, key_name: str):
+        """Bit offsets of key_name, by double hashing one SHA-256."""
+        digest = hashlib.sha256(key_name.encode()).digest()
+        first = int.from_bytes(digest[:8], "big")
+        step = int.from_bytes(digest[8:16], "big") | 1
+        return [(first + i * step) % self.bits for i in range(self.hashes)]
+
+
+def key_name_filter():
+    return KeyNameFilter(settings.key_name_filter_bits, settings.key_name_filter_hashes)
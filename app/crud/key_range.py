@@ -0,0 +1,106 @@
+import base64
+from datetime import date, datetime, time, timedelta, timezone
+from sqlmodel import select, and_, or_, func
+
+# Fact tables are keyed by (date_key, time_key) with date_key in YYYYMMDD and
+# time_key in HHMM format. Range filters are written against those keys so
+# the primary key index can be used for the seek and the ordering.
+
+
+def naive_utc(value: datetime):
+    # the keys hold UTC wall clock, an offset given by the client is applied first
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def to_keys(value: datetime):
+    value = naive_utc(value)
+    return value.strftime("%Y%m%d"), value.strftime("%H%M")
+
+
+def from_keys(date_key: str, time_key: str):
+    return datetime.strptime(f"{date_key}{time_key}", "%Y%m%d%H%M")
+
+
+def date_bounds(start_date: date = None, end_date: date = None):
+    # both ends are whole days
+    start = datetime.combine(start_date, time.min) if start_date else None
+    end = datetime.combine(end_date, time(23, 59, 59)) if end_date else None
+    return start, end
+
+
+def resolve_time_of_day(first: datetime, value: time = None):
+    # the lastday tables span midnight, so a time of day is mapped to its
+    # occurrence within the 24h window starting at the first row
+    if value is None or first is None:
+        return None
+    resolved = datetime.combine(first.date(), value)
+    if resolved < first:
+        resolved += timedelta(days=1)
+    return resolved
+
+
+def key_range(table, start: datetime = None, end: datetime = None):
+    """WHERE clauses selecting start <= (date_key, time_key) <= end."""
+    clauses = []
+    if start:
+        date_key, time_key = to_keys(start)
+        if start.time() == time.min:
+            clauses.append(table.date_key >= date_key)
+        else:
+            clauses.append(and_(
+                table.date_key >= date_key,
+                or_(table.date_key > date_key, table.time_key >= time_key),
+            ))
+    if end:
+        date_key, time_key = to_keys(end)
+        if time_key == "2359":
+            clauses.append(table.date_key <= date_key)
+        else:
+            clauses.append(and_(
+                table.date_key <= date_key,
+                or_(table.date_key < date_key, table.time_key <= time_key),
+            ))
+    return clauses
+
+
+def after_keys(table, date_key: str, time_key: str):
+    """WHERE clause selecting (date_key, time_key) strictly after the given keys."""
+    return and_(
+        table.date_key >= date_key,
+        or_(table.date_key > date_key, table.time_key > time_key),
+    )
+
+
+def encode_cursor(date_key: str, time_key: str):
+    return base64.urlsafe_b64encode(f"{date_key}:{time_key}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """(date_key, time_key) from a cursor, ValueError if it was tampered with."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        date_key, time_key = base64.urlsafe_b64decode(padded).decode().split(":")
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("invalid cursor")
+    if not (len(date_key) == 8 and date_key.isdigit() and len(time_key) == 4 and time_key.isdigit()):
+        raise ValueError("invalid cursor")
+    return date_key, time_key
+
+
+def watermark_statement(table):
+    # newest key through the primary key index plus the row count, one round trip
+    row_count = select(func.count()).select_from(table).scalar_subquery()
+    return (
+        select(table.date_key, table.time_key, row_count.label("row_count"))
+        .order_by(table.date_key.desc(), table.time_key.desc())
+        .limit(1)
+    )
+
+
+def data_version(watermark):
+    """Version string of a fact table from its watermark row, "0" when empty."""
+    if watermark is None:
+        return "0"
+    return f"{watermark.date_key}{watermark.time_key}.{watermark.row_count}"
@@ -0,0 +1,54 @@
+import asyncio
+from .column_store import ColumnStore
+
+LIVE_DATASETS = ("chart", "ohlc")
+
+
+def live_message(dataset: str, points: ColumnStore):
+    # same rows as the json format of /get_liveChart and /get_liveOhlc
+    return b'{"dataset":"' + dataset.encode() + b'","points":' + points.to_rows_json() + b"}"
+
+
+class LiveHub:
+    """Live updates of this worker's WebSocket and SSE clients, fed once per worker by pub/sub."""
+    # a client that falls behind loses its oldest pending updates
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.subscribers = {dataset: set() for dataset in LIVE_DATASETS}
+
+    def subscribe(self, datasets):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        for dataset in datasets:
+            self.subscribers[dataset].add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        for queues in self.subscribers.values():
+            queues.discard(queue)
+
+    def publish(self, dataset: str, message: bytes):
+        for queue in self.subscribers.get(dataset, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((dataset, message))
+
+    def clients(self):
+        return len(set().union(*self.subscribers.values()))
+
+    async def events(self, datasets, keep_alive: float = 15.0):
+        """Server-sent events for datasets, with a comment line while idle to keep proxies open."""
+        queue = self.subscribe(datasets)
+        try:
+            while True:
+                try:
+                    dataset, message = await asyncio.wait_for(queue.get(), timeout=keep_alive)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                yield b"event: " + dataset.encode() + b"\ndata: " + message + b"\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+
+live_hub = LiveHub()
@@ -1,114 +1,83 @@
 from fastapi import Depends
 from core.session import get_session
-from sqlmodel import Session, select, func, col, cast
-from sqlalchemy import DateTime
-from db import ohlcHistory, Date,Time,Coin,Currency,ohlcLive
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from db import ohlcHistory, ohlcLive
 from schemas.schemas import ohlc_schema
+from .key_range import key_range, after_keys, to_keys, date_bounds, watermark_statement, data_version
+from .column_store import OHLC_LAYOUT
+from .dimension_registry import dimension_registry
 from datetime import datetime
 
 
 class OhlcService:
-    def __init__(self, session: Session=Depends(get_session)):
+    def __init__(self, session: AsyncSession=Depends(get_session)):
         self.session = session
 
 
-    def get_ohlc_history(self, limit: int = None, start_date: str = None, end_date: str = None):
-        statement = (
+    def ohlc_statement(self, table):
+        # fact columns only, labels come from the dimension registry
+        return (
             select(
-                # 1. CAST(CONCAT(...) AS DATETIME2)
-                cast(
-                    func.concat(Date.full_date, ' ', Time.time_of_day),
-                    DateTime
-                ).label("timestamp"),
-                
-                # 2. Column Aliasing (.label in SQLAlchemy/SQLModel)
-                Coin.coin_id.label("coin_name"),
-                Currency.currency_code.label("currency_name"),
-                ohlcHistory.open.label("open"),
-                ohlcHistory.high.label("high"),
-                ohlcHistory.low.label("low"),
-                ohlcHistory.close.label("close")
+                table.date_key,
+                table.time_key,
+                table.coin_key,
+                table.currency_key,
+                table.open.label("open"),
+                table.high.label("high"),
+                table.low.label("low"),
+                table.close.label("close")
             )
-            # 3. Joins
-            .join(Coin, ohlcHistory.coin_key == Coin.coin_key)
-            .join(Currency, ohlcHistory.currency_key == Currency.currency_key)
-            .join(Date, ohlcHistory.date_key == Date.date_key)
-            .join(Time, ohlcHistory.time_key == Time.time_key)
-            .order_by(col(Date.full_date), col(Time.time_of_day))
-
+            .order_by(table.date_key, table.time_key)
         )
-        if start_date:
-            statement = statement.where(
-                Date.full_date >= start_date
-            )
-        if end_date:
-            statement = statement.where(
-                Date.full_date <= end_date
-            )
-        statement = statement.limit(limit)
 
-        results = self.session.exec(statement).all()
+    async def get_ohlc_store(self, type: str):
+        """Whole history or lastday table as a ColumnStore, without an ohlc_schema per row."""
+        table = ohlcLive if type == "lastday" else ohlcHistory
+        results = (await self.session.exec(self.ohlc_statement(table))).all()
+        return await dimension_registry.build_store(self.session, OHLC_LAYOUT, results)
 
-        schema = [
-            ohlc_schema(
-                timestamp=str(row.timestamp),
-                coin_name=row.coin_name,
-                currency_name=row.currency_name,
-                open=row.open,
-                high=row.high,
-                low=row.low,
-                close=row.close
-            )
-            for row in results
-        ]
-        return schema
-    
-    def get_ohlc_lastday(self, limit : int = None, start_time: str = None, end_time: str = None):
-        statement = (
-            select(
-                # 1. CAST(CONCAT(...) AS DATETIME2)
-                cast(
-                    func.concat(Date.full_date, ' ', Time.time_of_day),
-                    DateTime
-                ).label("timestamp"),
-                
-                # 2. Column Aliasing (.label in SQLAlchemy/SQLModel)
-                Coin.coin_id.label("coin_name"),
-                Currency.currency_code.label("currency_name"),
-                ohlcLive.open.label("open"),
-                ohlcLive.high.label("high"),
-                ohlcLive.low.label("low"),
-                ohlcLive.close.label("close")
-            )
-            # 3. Joins
-            .join(Coin, ohlcLive.coin_key == Coin.coin_key)
-            .join(Currency, ohlcLive.currency_key == Currency.currency_key)
-            .join(Date, ohlcLive.date_key == Date.date_key)
-            .join(Time, ohlcLive.time_key == Time.time_key)
-            .order_by(col(Date.full_date), col(Time.time_of_day))
-        )
-    
-        if start_time:
-            statement = statement.where(Time.time_of_day >= start_time)
-        if end_time:
-            statement = statement.where(Time.time_of_day <= end_time)
+    async def get_ohlc_version(self, type: str):
+        table = ohlcLive if type == "lastday" else ohlcHistory
+        return data_version((await self.session.exec(watermark_statement(table))).first())
+
+    def ohlc_history_statement(self, limit: int = None, start_date: str = None, end_date: str = None, since: datetime = None):
+        statement = self.ohlc_statement(ohlcHistory)
+        statement = statement.where(*key_range(ohlcHistory, *date_bounds(start_date, end_date)))
+        if since:
+            statement = statement.where(after_keys(ohlcHistory, *to_keys(since)))
+        return statement.limit(limit)
+
+    async def stream_ohlc_history(self, limit: int = None, start_date: str = None, end_date: str = None, since: datetime = None, batch_size: int = 1000):
+        """Labelled history rows in batches, read through a server-side cursor."""
+        await dimension_registry.ensure(self.session)
+        statement = self.ohlc_history_statement(limit, start_date, end_date, since)
+        result = await self.session.stream(statement.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield dimension_registry.labels(rows)
 
-        statement = statement.limit(limit)
+    def ohlc_page_statement(self, after: tuple, end_date: str = None, limit: int = None):
+        statement = self.ohlc_statement(ohlcHistory)
+        statement = statement.where(after_keys(ohlcHistory, *after))
+        statement = statement.where(*key_range(ohlcHistory, *date_bounds(None, end_date)))
+        return statement.limit(limit)
 
-        results = self.session.exec(statement).all()
+    async def get_ohlc_page(self, after: tuple, end_date: str = None, limit: int = None):
+        """Page after the (date_key, time_key) of a cursor, an index seek whatever the offset."""
+        statement = self.ohlc_page_statement(after, end_date, limit)
+        results = (await self.session.exec(statement)).all()
+        return await self.to_schema(results)
 
-        schema = [
+    async def to_schema(self, results):
+        return [
             ohlc_schema(
-                timestamp=str(row.timestamp),
-                coin_name=row.coin_name,
-                currency_name=row.currency_name,
+                timestamp=str(timestamp),
+                coin_name=coin_name,
+                currency_name=currency_name,
                 open=row.open,
                 high=row.high,
                 low=row.low,
                 close=row.close
             )
-            for row in results
+            for timestamp, coin_name, currency_name, row in await dimension_registry.label_rows(self.session, results)
         ]
-        return schema
-    
-    
\ No newline at end of file
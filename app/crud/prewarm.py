@@ -0,0 +1,40 @@
+import json
+from collections import Counter
+from datetime import date, time
+
+# scores of all workers, most requested query shapes first
+QUERY_SHAPES_KEY = "prewarm:shapes"
+# applied once per flush interval so old traffic fades out of the top N
+SHAPE_DECAY = 0.9
+# shapes kept in the sorted set, the long tail is trimmed
+MAX_SHAPES = 1000
+
+
+class QueryShapes:
+    """Counts the data query shapes served by this process between two flushes."""
+    # a shape is the request kind plus the arguments that build its body
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def record(self, kind: str, **params):
+        params = {name: value.isoformat() if isinstance(value, (date, time)) else value for name, value in params.items()}
+        self.counts[json.dumps({"kind": kind, "params": params}, sort_keys=True)] += 1
+
+    def drain(self):
+        counts, self.counts = self.counts, Counter()
+        return counts
+
+
+def load_shape(raw: str):
+    """(kind, params) of a recorded shape, start/end typed as the endpoints pass them."""
+    shape = json.loads(raw)
+    params = shape["params"]
+    parse = date.fromisoformat if params["type"] == "history" else time.fromisoformat
+    for bound in ("start", "end"):
+        if params.get(bound) is not None:
+            params[bound] = parse(params[bound])
+    return shape["kind"], params
+
+
+query_shapes = QueryShapes()
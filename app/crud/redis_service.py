@@ -1,132 +1,386 @@
-import redis
-import json
-from schemas.schemas import chart_schema, ohlc_schema
-from pydantic import ValidationError
+import hashlib
+from redis.exceptions import RedisError
 from db import APIkey
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+import asyncio
+import math
+import uuid
+from .prewarm import QUERY_SHAPES_KEY, SHAPE_DECAY, MAX_SHAPES
+
+
+# KEYS: auth, credential, usage of the current UTC day, last_request, dirty set, rate buckets,
+#       failed key name, failed key name + digest
+# ARGV: credential digest, request timestamp (UTC), requests to charge, key name
+# Returns {status, limit, remaining, retry after in ms}
+CONSUME_REQUEST_SCRIPT = """
+local raw_auth = redis.call('GET', KEYS[1])
+local digest = redis.call('GET', KEYS[2])
+if not raw_auth or not digest then
+    if redis.call('EXISTS', KEYS[7], KEYS[8]) > 0 then
+        return {-2, 0, 0, 0}
+    end
+    return {-1, 0, 0, 0}
+end
+if digest ~= ARGV[1] then
+    return {-2, 0, 0, 0}
+end
+
+local api_key = cjson.decode(raw_auth)
+local cost = tonumber(ARGV[3])
+local per_day = tonumber(api_key['rate_limit_per_day'])
+local usage = tonumber(redis.call('GET', KEYS[3]) or '0')
+if usage + cost > per_day then
+    return {0, per_day, per_day - usage, 0}
+end
+
+-- token buckets refilled continuously, a full bucket lets a request
+-- bigger than it through and leaves the bucket in debt; the Redis clock is
+-- used so app hosts with skewed clocks agree on the refills
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local buckets = {}
+local limit, retry = 0, 0
+for _, tier in ipairs({{'second', 1000}, {'minute', 60000}}) do
+    local rate = tonumber(api_key['rate_limit_per_' .. tier[1]])
+    if rate and rate > 0 then
+        local state = redis.call('HMGET', KEYS[6], tier[1] .. ':tokens', tier[1] .. ':at')
+        local tokens = tonumber(state[1]) or rate
+        local at = tonumber(state[2]) or now
+        tokens = math.min(rate, tokens + math.max(now - at, 0) * rate / tier[2])
+        local needed = math.min(cost, rate)
+        if tokens < needed then
+            local wait = math.ceil((needed - tokens) * tier[2] / rate)
+            if wait > retry then
+                limit, retry = rate, wait
+            end
+        end
+        -- time until the bucket is full again, debt included
+        local refill = (rate - tokens + cost) * tier[2] / rate
+        table.insert(buckets, {tier[1], tokens - cost, refill})
+    end
+end
+if retry > 0 then
+    return {-3, limit, 0, retry}
+end
+local refill = 0
+for _, bucket in ipairs(buckets) do
+    redis.call('HSET', KEYS[6], bucket[1] .. ':tokens', tostring(bucket[2]), bucket[1] .. ':at', tostring(now))
+    refill = math.max(refill, bucket[3])
+end
+if #buckets > 0 then
+    -- the hash only goes once every bucket has refilled, so expiry never forgives debt
+    redis.call('PEXPIRE', KEYS[6], math.max(math.ceil(refill), 1))
+end
+
+usage = redis.call('INCRBY', KEYS[3], cost)
+if usage == cost then
+    redis.call('EXPIRE', KEYS[3], 172800)
+end
+redis.call('SET', KEYS[4], ARGV[2], 'EX', 86400)
+redis.call('SADD', KEYS[5], ARGV[4])
+return {usage, per_day, per_day - usage, 0}
+"""
+
+
+# KEYS: lock   ARGV: token of the holder
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def usage_key(key_name: str, day: datetime = None):
+    """Usage counter of key_name for a UTC day, today by default, so nothing resets at midnight."""
+    day = day or datetime.now(timezone.utc)
+    return f"usage:{key_name}:{day:%Y%m%d}"
+
+
+# names of the API keys whose usage changed since the last DB sync
+DIRTY_KEYS_SET = "dirty:api_keys"
+CACHE_INVALIDATION_CHANNEL = "cache:invalidate"
+# live:chart and live:ohlc carry the points added by each load
+LIVE_CHANNEL_PREFIX = "live:"
+
+
+class RateLimit(NamedTuple):
+    """Outcome of consume_request, reset is the seconds until the limit that applied frees up."""
+    status: int
+    limit: int = 0
+    remaining: int = 0
+    reset: int = 0
+
+
+def seconds_to_midnight(now: datetime = None):
+    # daily usage buckets roll over at midnight UTC
+    now = now or datetime.now(timezone.utc)
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+    return math.ceil((midnight - now).total_seconds())
+
+
+def variant_key(key: str, encoding: str):
+    # identity lives under the plain key, compressed variants next to it
+    return key if encoding == "identity" else f"{key}:{encoding}"
 
 
 class RedisService:
 
+    AUTH_NOT_CACHED = -1
+    AUTH_FAILED = -2
+    RATE_LIMITED = 0
+    THROTTLED = -3
 
-    def __init__(self, redis_host):
+    def __init__(self, redis_host, redis_data=None):
         self.r = redis_host
+        # binary-safe client for cached data:* bodies, falls back to the main one
+        self.data = redis_data if redis_data is not None else redis_host
+        self._consume_request = self.r.register_script(CONSUME_REQUEST_SCRIPT)
+        self._release_lock = self.r.register_script(RELEASE_LOCK_SCRIPT)
 
-    def set_key(self, key: str, value: str, ex: int = None):
-        self.r.set(key, value, ex=ex)
+    async def set_key(self, key: str, value: str, ex: int = None):
+        await self.r.set(key, value, ex=ex)
 
-    def get_value(self, key: str):
-        return self.r.get(key)
+    async def get_value(self, key: str):
+        return await self.r.get(key)
     
-    def authenticate_apikey(self, keyname_provided:str, provided_key: str):
+    async def set_data(self, key: str, value: bytes, ex: int = None):
+        await self.data.set(key, value, ex=ex)
+
+    async def get_data(self, key: str):
+        return await self.data.get(key)
+
+    async def set_variants(self, key: str, variants: dict, ex: int = None):
+        async with self.data.pipeline() as pipe:
+            for encoding, body in variants.items():
+                pipe.set(variant_key(key, encoding), body, ex=ex)
+            await pipe.execute()
+
+    async def get_variant(self, key: str, encoding: str):
+        """(body, encoding) for key in the requested encoding or what was stored instead, None on a miss."""
+        return (await self.get_variants([key], encoding))[0]
+
+    async def get_variants(self, keys: list, encoding: str):
+        # one MGET for every key, the wanted variant and its fallback side by side
+        fallback = "zstd" if encoding == "identity" else "identity"
+        values = await self.data.mget([variant_key(key, e) for key in keys for e in (encoding, fallback)])
+        found = []
+        for wanted, stored in zip(values[::2], values[1::2]):
+            if wanted is not None:
+                found.append((wanted, encoding))
+            elif stored is not None:
+                found.append((stored, fallback))
+            else:
+                found.append(None)
+        return found
+
+    async def cache_apikey(self, key_name: str, api_key_json: str, provided_key: str, ex: int = None):
+        # the digest lets the consume script check the secret without a DB round trip
+        async with self.r.pipeline() as pipe:
+            pipe.set(f"auth:{key_name}", api_key_json, ex=ex)
+            pipe.set(f"credential:{key_name}", self.credential_digest(provided_key), ex=ex)
+            await pipe.execute()
+
+    def credential_digest(self, provided_key: str) -> str:
+        # API keys are random uuid4 hex strings, an unsalted digest is enough here
+        return hashlib.sha256(provided_key.encode()).hexdigest()
+
+    async def consume_request(self, keyname_provided: str, provided_key: str, cost: int = 1):
+        """Authenticate, enforce the daily limit and token buckets and count the request in one round trip."""
+        # status is the new usage count or AUTH_NOT_CACHED, AUTH_FAILED, RATE_LIMITED or THROTTLED
         if keyname_provided == "" or provided_key == "":
-            return False
-        redis_key = f"auth:{keyname_provided}"
-        redis_value = self.get_value(redis_key)
-        if redis_value is None:
-            return False
+            return RateLimit(self.AUTH_FAILED)
+        digest = self.credential_digest(provided_key)
+        status, limit, remaining, retry_ms = await self._consume_request(
+            keys=[
+                f"auth:{keyname_provided}",
+                f"credential:{keyname_provided}",
+                usage_key(keyname_provided),
+                f"last_request:{keyname_provided}",
+                DIRTY_KEYS_SET,
+                f"rate:{keyname_provided}",
+                f"auth_fail:{keyname_provided}",
+                f"auth_fail:{keyname_provided}:{digest}",
+            ],
+            args=[digest, datetime.now(timezone.utc).isoformat(), cost, keyname_provided],
+        )
+        reset = math.ceil(retry_ms / 1000) if status == self.THROTTLED else seconds_to_midnight()
+        return RateLimit(int(status), int(limit), max(int(remaining), 0), reset)
+
+    async def cache_auth_failure(self, key_name: str, provided_key: str = None, ex: int = 60):
+        """Remember a failed lookup, without provided_key the name itself is unknown."""
+        if provided_key is None:
+            await self.r.set(f"auth_fail:{key_name}", 1, ex=ex)
         else:
-            return redis_value
-            
-    # We assume that the authenticate func is called before this one
-    def check_rate_limit(self, keyname_provided: str):
-        try:
-            usage_key = f"usage:{keyname_provided}"
-            auth_key = f"auth:{keyname_provided}"
-            
-            # 1. Efficiently get auth data
-            raw_auth = self.get_value(auth_key)
-            if not raw_auth:
-                return False 
-            
-            api_info = APIkey.model_validate_json(raw_auth)
-            
-            # 2. Atomic check and increment
-            # Use INCRBY 0 to get current value without changing it, or just GET
-            current_usage = int(self.get_value(usage_key) or 0)
-
-            if current_usage >= api_info.rate_limit_per_day:
-                self.deactivate_key(keyname_provided)
-                return False
-                
-            return True
-        except Exception as e:
-            # Logging here would be better than returning an Exception object
-            return False
-        
-    def deactivate_key(self, key_name: str):
-        raw_auth = self.get_value(f"auth:{key_name}")
+            await self.r.set(f"auth_fail:{key_name}:{self.credential_digest(provided_key)}", 1, ex=ex)
+
+    async def clear_auth_failure(self, key_name: str):
+        # a name created after a failed lookup must work right away
+        await self.r.delete(f"auth_fail:{key_name}")
+
+    async def key_name_filter_ready(self, key: str, ready_bit: int):
+        return bool(await self.r.getbit(key, ready_bit))
+
+    async def set_key_name_filter_ready(self, key: str, ready_bit: int):
+        await self.r.setbit(key, ready_bit, 1)
+
+    async def may_have_key_name(self, key: str, ready_bit: int, positions: list):
+        """False only when the built key name filter rules the name out."""
+        async with self.r.pipeline(transaction=False) as pipe:
+            pipe.getbit(key, ready_bit)
+            for position in positions:
+                pipe.getbit(key, position)
+            ready, *bits = await pipe.execute()
+        return not ready or all(bits)
+
+    async def add_key_names(self, key: str, positions: list):
+        async with self.r.pipeline(transaction=False) as pipe:
+            for position in positions:
+                pipe.setbit(key, position, 1)
+            await pipe.execute()
+
+    async def deactivate_key(self, key_name: str):
+        raw_auth = await self.get_value(f"auth:{key_name}")
         if raw_auth:
             api_key_obj = APIkey.model_validate_json(raw_auth)
             
             api_key_obj.is_active = False
             
-            self.set_key(f"auth:{key_name}", api_key_obj.model_dump_json(), ex=300)
-        
-    # we assume that the check rate limit func is called before this one
-    def increment_request_count(self, keyname_provided: str):
-        try:
-            redis_key = f"usage:{keyname_provided}"
-            auth_key = f"auth:{keyname_provided}"
-            new_count = self.r.incr(redis_key)
-
-            if new_count == 1:
-                self.r.expire(redis_key, 86400)
-            raw_auth = self.r.get(auth_key)
-
-            if raw_auth:
-                data = json.loads(raw_auth)
-                data["requests_made_today"] = new_count
-                self.r.set(auth_key, json.dumps(data))            
-        except Exception as e:
-            return Exception(f"Error incrementing request count: {str(e)}")
-
-    def reset_daily_limit(self):
-        try:    
-            for key in self.r.scan_iter("usage:*"):
-                self.set_key(key, 0, ex=86400)
-            return True
-        except Exception as e:
-            return Exception(f"Error resetting daily limit: {str(e)}")
+            async with self.r.pipeline() as pipe:
+                pipe.set(f"auth:{key_name}", api_key_obj.model_dump_json(), ex=300)
+                pipe.sadd(DIRTY_KEYS_SET, key_name)
+                await pipe.execute()
+
+    async def drain_dirty_keys(self):
+        """Names marked dirty since the last call, read and cleared in one transaction."""
+        async with self.r.pipeline(transaction=True) as pipe:
+            pipe.smembers(DIRTY_KEYS_SET)
+            pipe.delete(DIRTY_KEYS_SET)
+            names, _ = await pipe.execute()
+        return sorted(names)
+
+    async def mark_dirty(self, names: list):
+        # puts back the names of a sync that did not reach the DB
+        if names:
+            await self.r.sadd(DIRTY_KEYS_SET, *names)
+
+    async def get_usage(self, names: list):
+        """(auth json, usage today, last request) of every name, in one round trip."""
+        async with self.r.pipeline(transaction=False) as pipe:
+            pipe.mget([f"auth:{name}" for name in names])
+            pipe.mget([usage_key(name) for name in names])
+            pipe.mget([f"last_request:{name}" for name in names])
+            auths, usages, last_requests = await pipe.execute()
+        return list(zip(auths, usages, last_requests))
         
-    def cache_chart(self,type : str, limit : int, start: str, end: str):
-        redis_key = f"data:chart_{type}:{limit}:{start}:{end}"
-        redis_value = self.get_value(redis_key)
-        if redis_value is None:
-            return False
-        else:
-            try:
-                data_list = json.loads(redis_value)
-                return [chart_schema.model_validate(item) for item in data_list]
-            except (ValidationError, json.JSONDecodeError):
-                return None
-            
-    def cache_ohlc(self,type : str, limit : int, start: str, end: str):
-        redis_key = f"data:ohlc_{type}:{limit}:{start}:{end}"
-        redis_value = self.get_value(redis_key)
-        if redis_value is None:
-            return False
-        else:
+    async def get_data_versions(self, names: list):
+        """(current, previous) version of every table, previous only inside its grace window."""
+        values = await self.r.mget(
+            [f"data_version:{name}" for name in names] + [f"data_version_previous:{name}" for name in names]
+        )
+        return list(zip(values[:len(names)], values[len(names):]))
+
+    async def swap_data_version(self, name: str, version: str):
+        # SET ... GET: only the worker that actually moves the version sees a change
+        return await self.r.set(f"data_version:{name}", version, get=True)
+
+    async def set_previous_version(self, name: str, version: str, ex: int):
+        await self.r.set(f"data_version_previous:{name}", version, ex=ex)
+
+    async def acquire_lock(self, key: str, ex: int):
+        """Token when this caller now holds lock:{key} for ex seconds, else None."""
+        token = uuid.uuid4().hex
+        if await self.r.set(f"lock:{key}", token, nx=True, ex=ex):
+            return token
+        return None
+
+    async def release_lock(self, key: str, token: str):
+        # only the holder may release, the lock may have expired and been taken over
+        await self._release_lock(keys=[f"lock:{key}"], args=[token])
+
+    async def wait_for_data(self, key: str, timeout: float, interval: float = 0.05):
+        """Poll for key while another worker holds its lock, None if the lock goes or on timeout."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while asyncio.get_running_loop().time() < deadline:
+            value = await self.data.get(key)
+            if value is not None:
+                return value
+            if not await self.r.exists(f"lock:{key}"):
+                return await self.data.get(key)
+            await asyncio.sleep(interval)
+        return None
+
+    async def expire_data(self, prefix: str, seconds: int, batch_size: int = 500):
+        async for keys in self.scan_data(prefix, batch_size):
+            async with self.data.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.expire(key, seconds)
+                await pipe.execute()
+
+    async def delete_data(self, prefix: str, batch_size: int = 500):
+        async for keys in self.scan_data(prefix, batch_size):
+            await self.data.unlink(*keys)
+
+    async def scan_data(self, prefix: str, batch_size: int = 500):
+        keys = []
+        async for key in self.data.scan_iter(match=f"{prefix}*", count=batch_size):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                yield keys
+                keys = []
+        if keys:
+            yield keys
+
+    async def flush_query_shapes(self, counts: dict, decay_every: int):
+        async with self.r.pipeline() as pipe:
+            # decay once per interval however many workers flush
+            if await self.r.set(f"{QUERY_SHAPES_KEY}:decayed", 1, nx=True, ex=decay_every):
+                pipe.zunionstore(QUERY_SHAPES_KEY, {QUERY_SHAPES_KEY: SHAPE_DECAY})
+            for shape, count in counts.items():
+                pipe.zincrby(QUERY_SHAPES_KEY, count, shape)
+            pipe.zremrangebyrank(QUERY_SHAPES_KEY, 0, -(MAX_SHAPES + 1))
+            await pipe.execute()
+
+    async def top_query_shapes(self, n: int):
+        return await self.r.zrevrange(QUERY_SHAPES_KEY, 0, n - 1)
+
+    async def publish_invalidation(self, prefix: str = "data:"):
+        return await self.r.publish(CACHE_INVALIDATION_CHANNEL, prefix)
+
+    async def listen_invalidations(self, callback):
+        """Call callback(prefix) for every invalidation published by any worker."""
+        await self.listen(self.r, [CACHE_INVALIDATION_CHANNEL], lambda channel, data: callback(data))
+
+    async def publish_live(self, dataset: str, message: bytes):
+        return await self.data.publish(f"{LIVE_CHANNEL_PREFIX}{dataset}", message)
+
+    async def listen_live(self, datasets, callback):
+        """Call callback(dataset, message) for every live update, once per worker."""
+        channels = [f"{LIVE_CHANNEL_PREFIX}{dataset}" for dataset in datasets]
+        await self.listen(self.data, channels, lambda channel, data: callback(
+            channel.decode().removeprefix(LIVE_CHANNEL_PREFIX), data
+        ))
+
+    async def listen(self, client, channels: list, callback):
+        while True:
             try:
-                data_list = json.loads(redis_value)
-                return [ohlc_schema.model_validate(item) for item in data_list]
-            except (ValidationError, json.JSONDecodeError):
-                return None
-    
-    def update_lastrequest_date(self, key_name: str):
-        raw_auth = self.get_value(f"auth:{key_name}")
-        if raw_auth:
-            api_key_obj = APIkey.model_validate_json(raw_auth)
-            
-            api_key_obj.last_request_date = datetime.now()
-            
-            self.set_key(f"auth:{key_name}", api_key_obj.model_dump_json(), ex=300)
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(*channels)
+                    while True:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message is not None:
+                            callback(message["channel"], message["data"])
+            except (RedisError, OSError) as e:
+                # redis restarted or timed out, resubscribe after a short pause
+                print(f"Listener error on {channels}: {e}")
+                await asyncio.sleep(1)
 
-    def scan_over_keys(self):
+    async def scan_over_keys(self):
         print("Step 1: Starting scan...")
-        for key in self.r.scan_iter("usage:*"):
+        async for key in self.r.scan_iter("usage:*"):
             print(f"Step 2: Found key {key}, fetching value...")
-            value = self.r.get(key)
+            value = await self.r.get(key)
             print(f"Step 3: Value is {value}")
         print("Step 4: Done!")
     # def refresh_db_apicash(self):
@@ -0,0 +1,43 @@
+import asyncio
+
+
+class SingleFlight:
+    """Runs one fill per key at a time, concurrent callers share its result or exception."""
+    # if the caller doing the fill is cancelled, one of the waiters takes over
+
+    def __init__(self):
+        self._calls = {}
+
+    def running(self, key: str):
+        return key in self._calls
+
+    async def do(self, key: str, fill):
+        while key in self._calls:
+            future = self._calls[key]
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fill()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark it retrieved, nobody may be waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+
+single_flight = SingleFlight()
@@ -13,6 +13,9 @@ class APIkey(SQLModel, table=True):
     is_active: bool = Field(default=True)
 
     rate_limit_per_day: int = Field(default=100)
+    # burst control in front of the DB, 0 turns a tier off
+    rate_limit_per_second: int = Field(default=5)
+    rate_limit_per_minute: int = Field(default=60)
     requests_made_today: int = Field(default=0)
     last_request_date: Optional[datetime] = Field(default=None)
 
@@ -1,145 +1,480 @@
-from contextlib import contextmanager
-from fastapi import FastAPI, Depends, HTTPException, Query
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from fastapi_utilities import repeat_every 
-from sqlmodel import SQLModel, Session
-from core.session import engine
-from core.session import get_session, get_redis
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from core.session import new_session, new_read_session
+from core.session import get_session, get_read_session, get_redis, get_redis_data, get_local_cache
 from schemas.schemas import *
 from crud.data_manager import DataManager
-from datetime import date, time
+from crud.redis_service import RedisService, RateLimit
+from crud.formats import MEDIA_TYPES, STORE_FORMATS, negotiate
+from crud.compression import negotiate_encoding
+from crud.column_store import parse_interval
+from crud.key_range import decode_cursor
+from crud.data_versions import data_versions
+from crud.live_hub import live_hub, LIVE_DATASETS
+from crud.dimension_registry import dimension_registry
+from core.config import settings
+from datetime import date, time, datetime
 import asyncio
+import logging
 
 
 app = FastAPI()
+logger = logging.getLogger(__name__)
 
+HISTORY_FORMATS = STORE_FORMATS + ("ndjson", "csv")
 
-@contextmanager
-def get_dm_context():
+
+@asynccontextmanager
+async def get_dm_context():
     """Manual factory for background tasks."""
-    # 1. Create session manually
-    with Session(engine) as session:
+    # 1. Create sessions manually, writes on the primary and reads on the replica
+    async with new_session() as session, new_read_session() as read_session:
         # 2. Get redis (call the actual logic, not the FastAPI dependency)
         gen = get_redis()
-        redis_client = next(gen) 
+        redis_client = await anext(gen)
+        redis_data = await anext(get_redis_data())
         # 3. Provide the DM
-        yield DataManager(session, redis_client)
+        yield DataManager(session, redis_client, get_local_cache(), redis_data, read_session)
     # Session closes automatically here
 
 
+def drop_invalidated(prefix: str):
+    get_local_cache().invalidate(prefix)
+    # new table data: versions are read again and may reference new dimension rows
+    data_versions.invalidate()
+    dimension_registry.invalidate()
+
+
+@app.on_event("startup")
+async def listen_cache_invalidation():
+    # drop L1 entries whenever any worker publishes an invalidation
+    redis_client = await anext(get_redis())
+    app.state.invalidation_listener = asyncio.create_task(
+        RedisService(redis_client).listen_invalidations(drop_invalidated)
+    )
+
+
+@app.on_event("startup")
+async def listen_live_updates():
+    # one subscription per worker, fanned out to the sockets of this process
+    redis_client = await anext(get_redis())
+    redis_data = await anext(get_redis_data())
+    app.state.live_listener = asyncio.create_task(
+        RedisService(redis_client, redis_data).listen_live(LIVE_DATASETS, live_hub.publish)
+    )
+
+
+@app.on_event("startup")
+@repeat_every(seconds=settings.data_version_seconds)
+async def probe_data_versions():
+    async with get_dm_context() as dm:
+        changed = await dm.refresh_data_versions()
+        if changed:
+            await dm.publish_live(changed)
+            warmed = await dm.prewarm(changed)
+            print(f"New data in {changed}, prewarmed {warmed} query shapes.")
+
+
+@app.on_event("startup")
+@repeat_every(seconds=settings.prewarm_flush_seconds)
+async def flush_query_shapes():
+    async with get_dm_context() as dm:
+        await dm.flush_query_shapes()
+
+
+@app.on_event("startup")
+@repeat_every(seconds=15 * 60)  # rebuilt if it was evicted or the settings changed
+async def build_key_name_filter():
+    if settings.key_name_filter:
+        async with get_dm_context() as dm:
+            if await dm.build_key_name_filter():
+                print("Key name filter built.")
+
+
 @app.on_event("startup")
 @repeat_every(seconds=15 * 60)  # 15 minutes
 async def db_sync():
-    await asyncio.to_thread(sync_worker)
+    async with get_dm_context() as dm:
+        await dm.refresh_db_apicash()
     print("Database synchronized with API data.")
 
-def sync_worker():
-    with get_dm_context() as dm:
-        dm.refresh_db_apicash()
-        
 
 @app.on_event("startup")
-@repeat_every(seconds=24 * 60 * 60)  # 24 hours
-async def reset_counts():
-    with get_dm_context() as dm:
-        dm.reset_daily_limit()
+@repeat_every(seconds=15 * 60)
+async def log_cache_stats():
+    logger.info("local cache %s", get_local_cache().stats())
+
+
+@app.middleware("http")
+async def add_rate_limit_headers(request: Request, call_next):
+    response = await call_next(request)
+    response.headers.update(getattr(request.state, "rate_limit_headers", {}))
+    return response
+
+def rate_limit_headers(limit: RateLimit):
+    headers = {
+        "X-RateLimit-Limit": str(limit.limit),
+        "X-RateLimit-Remaining": str(limit.remaining),
+        "X-RateLimit-Reset": str(limit.reset),
+    }
+    if limit.status in (RedisService.RATE_LIMITED, RedisService.THROTTLED):
+        headers["Retry-After"] = str(limit.reset)
+    return headers
+
+async def authorize(request: Request, data_manager: DataManager, key_name: str, api_key: str, cost: int = 1):
+    limit = await data_manager.authorize_request(key_name, api_key, cost)
+    if limit.status == RedisService.AUTH_FAILED:
+        raise HTTPException(status_code=404, detail="key name or api key not found")
+    elif limit.status == RedisService.RATE_LIMITED:
+        raise HTTPException(status_code=429, detail="Too many requests", headers=rate_limit_headers(limit))
+    elif limit.status == RedisService.THROTTLED:
+        raise HTTPException(status_code=429, detail="Too many requests per second or minute", headers=rate_limit_headers(limit))
+    # added to whichever response the endpoint returns by add_rate_limit_headers
+    request.state.rate_limit_headers = rate_limit_headers(limit)
+
+def response_format(format: Optional[str], accept: Optional[str], allowed: tuple):
+    # negotiated before authorize so an unusable request is not charged
+    negotiated = negotiate(format, accept, allowed)
+    if negotiated is None:
+        raise HTTPException(status_code=406, detail=f"supported formats: {', '.join(allowed)}")
+    return negotiated
 
-def get_dm(session:Session=Depends(get_session),redis_host=Depends(get_redis) ):
-    return DataManager(session, redis_host)
+def candle_interval(interval: str):
+    try:
+        return parse_interval(interval)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="interval must look like 15m, 1h, 4h, 1d or 1w, and be at most 1w")
+
+def indicator_source(indicator: str, source: str):
+    if indicator == "vwap" and source != "chart":
+        raise HTTPException(status_code=400, detail="vwap needs volumes, use source=chart")
+
+def encoded_response(body: bytes, content_encoding: str, format: str):
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if content_encoding != "identity":
+        headers["Content-Encoding"] = content_encoding
+    return Response(content=body, media_type=MEDIA_TYPES[format], headers=headers)
+
+def get_dm(session:AsyncSession=Depends(get_session),redis_host=Depends(get_redis),local_cache=Depends(get_local_cache),redis_data=Depends(get_redis_data),read_session:AsyncSession=Depends(get_read_session)):
+    return DataManager(session, redis_host, local_cache, redis_data, read_session)
 
 @app.put("/generareApi/", response_model=upload_API_key_schema)
 async def generate_apikey(create_API_schema: create_API_key_schema, data_manager : DataManager=Depends(get_dm)):
-    new_key = data_manager.generate_apikey(response_model=create_API_schema)
+    new_key = await data_manager.generate_apikey(response_model=create_API_schema)
     if not new_key:
         raise HTTPException(status_code=401, detail="key name already exists")
     return new_key
 
 @app.get("/get_historyChart")
-async def get_HistorychartData(key_name:str,
+async def get_HistorychartData(request: Request, key_name:str,
                              api_key : str,
                              start_date : Optional[date]=Query(None, description="Start date in YYYY-MM-DD format"),
                              end_date : Optional[date]=Query(None, description="End date in YYYY-MM-DD format"),
-                            limit : int = None,
+                            limit : Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+                             since : Optional[datetime] = Query(None, description="Only rows strictly newer than this timestamp, e.g. the last one the client has. UTC unless it carries an offset"),
+                             cursor : Optional[str] = Query(None, description="X-Next-Cursor of the previous page, pages are json"),
+                             format : Optional[str] = Query(None, description="json, columnar, msgpack, arrow, or ndjson/csv to stream large ranges. Defaults to the Accept header"),
+                             accept : Optional[str] = Header(None),
+                             accept_encoding : Optional[str] = Header(None),
                              data_manager :DataManager=Depends(get_dm)):
-    if not data_manager.authenticate_apikey(key_name, api_key):
-        raise HTTPException(status_code=404, detail="key name or api key not found")
-    elif not data_manager.check_rate_limit(key_name):
-        raise HTTPException(status_code=429, detail="Too many requests")
+    format = response_format(format, accept, HISTORY_FORMATS)
+    if cursor and since:
+        raise HTTPException(status_code=400, detail="cursor and since cannot be combined")
+    if cursor and format != "json":
+        raise HTTPException(status_code=400, detail="cursor pages are only served as json")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    await authorize(request, data_manager, key_name, api_key)
+    if format in ("ndjson", "csv"):
+        return StreamingResponse(
+            data_manager.stream_history("chart", limit, start_date, end_date, format, since),
+            media_type=MEDIA_TYPES[format]
+        )
+    if cursor:
+        chart_data, next_cursor = await data_manager.get_page("chart", after, end_date, limit)
+        content_encoding = "identity"
     else:
-        chart_data = data_manager.get_chart(
+        chart_data, content_encoding = await data_manager.get_chart(
             type="history",
             limit = limit,
             start = start_date,
-            end=end_date
+            end=end_date,
+            format=format,
+            encoding=negotiate_encoding(accept_encoding),
+            since=since
         )
-        data_manager.increment_request_count(key_name)
-        data_manager.update_lastrequest_date(key_name)
-        return chart_data
+        next_cursor = await data_manager.next_cursor("chart", "history", limit, start_date, end_date, since)
+    response = encoded_response(chart_data, content_encoding, format)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
     
 @app.get("/get_liveChart")
-async def get_livechartData(key_name:str,
+async def get_livechartData(request: Request, key_name:str,
                              api_key : str,
                              start_time : Optional[time]=Query(None, description="Start time in HH:MM:SS format"),
                              end_time : Optional[time]=Query(None, description="End time in HH:MM:SS format"),
-                            limit : int = None,
+                            limit : Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+                             since : Optional[datetime] = Query(None, description="Only rows strictly newer than this timestamp, e.g. the last one the client has. UTC unless it carries an offset"),
+                             format : Optional[str] = Query(None, description="json, columnar, msgpack or arrow. Defaults to the Accept header"),
+                             accept : Optional[str] = Header(None),
+                             accept_encoding : Optional[str] = Header(None),
                              data_manager: DataManager=Depends(get_dm)):
-    if not data_manager.authenticate_apikey(key_name, api_key):
-        raise HTTPException(status_code=404, detail="key name or api key not found")
-    elif not data_manager.check_rate_limit(key_name):
-        raise HTTPException(status_code=429, detail="Too many requests")
-    else:
-        chart_data = data_manager.get_chart(
-            type="lastday",
-            limit = limit,
-            start = start_time,
-            end=end_time
-        )
-        data_manager.increment_request_count(key_name)
-        data_manager.update_lastrequest_date(key_name)
-        return chart_data
+    format = response_format(format, accept, STORE_FORMATS)
+    await authorize(request, data_manager, key_name, api_key)
+    chart_data, content_encoding = await data_manager.get_chart(
+        type="lastday",
+        limit = limit,
+        start = start_time,
+        end=end_time,
+        format=format,
+        encoding=negotiate_encoding(accept_encoding),
+        since=since
+    )
+    return encoded_response(chart_data, content_encoding, format)
     
 
 @app.get("/get_historyOhlc")
-async def get_HistoryOhlcData(key_name:str,
+async def get_HistoryOhlcData(request: Request, key_name:str,
                              api_key : str,
                              start_date : Optional[date]=Query(None, description="Start date in YYYY-MM-DD format"),
                              end_date : Optional[date]=Query(None, description="End date in YYYY-MM-DD format"),
-                            limit : int = None,
+                            limit : Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+                             since : Optional[datetime] = Query(None, description="Only rows strictly newer than this timestamp, e.g. the last one the client has. UTC unless it carries an offset"),
+                             cursor : Optional[str] = Query(None, description="X-Next-Cursor of the previous page, pages are json"),
+                             format : Optional[str] = Query(None, description="json, columnar, msgpack, arrow, or ndjson/csv to stream large ranges. Defaults to the Accept header"),
+                             accept : Optional[str] = Header(None),
+                             accept_encoding : Optional[str] = Header(None),
                              data_manager: DataManager=Depends(get_dm)):
-    if not data_manager.authenticate_apikey(key_name, api_key):
-        raise HTTPException(status_code=404, detail="key name or api key not found")
-    elif not data_manager.check_rate_limit(key_name):
-        raise HTTPException(status_code=429, detail="Too many requests")
+    format = response_format(format, accept, HISTORY_FORMATS)
+    if cursor and since:
+        raise HTTPException(status_code=400, detail="cursor and since cannot be combined")
+    if cursor and format != "json":
+        raise HTTPException(status_code=400, detail="cursor pages are only served as json")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    await authorize(request, data_manager, key_name, api_key)
+    if format in ("ndjson", "csv"):
+        return StreamingResponse(
+            data_manager.stream_history("ohlc", limit, start_date, end_date, format, since),
+            media_type=MEDIA_TYPES[format]
+        )
+    if cursor:
+        ohlc_data, next_cursor = await data_manager.get_page("ohlc", after, end_date, limit)
+        content_encoding = "identity"
     else:
-        ohlc_data = data_manager.get_ohlc(
+        ohlc_data, content_encoding = await data_manager.get_ohlc(
             type="history",
             limit = limit,
             start = start_date,
-            end=end_date
+            end=end_date,
+            format=format,
+            encoding=negotiate_encoding(accept_encoding),
+            since=since
         )
-        data_manager.increment_request_count(key_name)
-        data_manager.update_lastrequest_date(key_name)
-        return ohlc_data
+        next_cursor = await data_manager.next_cursor("ohlc", "history", limit, start_date, end_date, since)
+    response = encoded_response(ohlc_data, content_encoding, format)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
     
 @app.get("/get_liveOhlc")
-async def get_liveOhlcData(key_name:str,
+async def get_liveOhlcData(request: Request, key_name:str,
                              api_key : str,
                              start_time : Optional[time]=Query(None, description="Start time in HH:MM:SS format"),
                              end_time : Optional[time]=Query(None, description="End time in HH:MM:SS format"),
-                            limit : int = None,
+                            limit : Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+                             since : Optional[datetime] = Query(None, description="Only rows strictly newer than this timestamp, e.g. the last one the client has. UTC unless it carries an offset"),
+                             format : Optional[str] = Query(None, description="json, columnar, msgpack or arrow. Defaults to the Accept header"),
+                             accept : Optional[str] = Header(None),
+                             accept_encoding : Optional[str] = Header(None),
                              data_manager: DataManager=Depends(get_dm)):
-    if not data_manager.authenticate_apikey(key_name, api_key):
-        raise HTTPException(status_code=404, detail="key name or api key not found")
-    elif not data_manager.check_rate_limit(key_name):
-        raise HTTPException(status_code=429, detail="Too many requests")
-    else:
-        ohlc_data = data_manager.get_ohlc(
-            type="lastday",
-            limit = limit,
-            start = start_time,
-            end=end_time
-        )
-        data_manager.increment_request_count(key_name)
-        data_manager.update_lastrequest_date(key_name)
-        return ohlc_data
+    format = response_format(format, accept, STORE_FORMATS)
+    await authorize(request, data_manager, key_name, api_key)
+    ohlc_data, content_encoding = await data_manager.get_ohlc(
+        type="lastday",
+        limit = limit,
+        start = start_time,
+        end=end_time,
+        format=format,
+        encoding=negotiate_encoding(accept_encoding),
+        since=since
+    )
+    return encoded_response(ohlc_data, content_encoding, format)
     
 
+
+
+@app.get("/get_historyCandles")
+async def get_HistoryCandlesData(request: Request, key_name:str,
+                             api_key : str,
+                             interval : str = Query("1d", description="Bar size such as 15m, 1h, 4h or 1d"),
+                             start_date : Optional[date]=Query(None, description="Start date in YYYY-MM-DD format"),
+                             end_date : Optional[date]=Query(None, description="End date in YYYY-MM-DD format"),
+                            limit : Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+                             format : Optional[str] = Query(None, description="json, columnar, msgpack or arrow. Defaults to the Accept header"),
+                             accept : Optional[str] = Header(None),
+                             accept_encoding : Optional[str] = Header(None),
+                             data_manager: DataManager=Depends(get_dm)):
+    seconds = candle_interval(interval)
+    format = response_format(format, accept, STORE_FORMATS)
+    await authorize(request, data_manager, key_name, api_key)
+    candle_data, content_encoding = await data_manager.get_candles(
+        type="history",
+        interval=seconds,
+        limit = limit,
+        start = start_date,
+        end=end_date,
+        format=format,
+        encoding=negotiate_encoding(accept_encoding)
+    )
+    return encoded_response(candle_data, content_encoding, format)
+
+@app.get("/get_liveCandles")
+async def get_liveCandlesData(request: Request, key_name:str,
+                             api_key : str,
+                             interval : str = Query("1h", description="Bar size such as 15m, 1h or 4h"),
+                             start_time : Optional[time]=Query(None, description="Start time in HH:MM:SS format"),
+                             end_time : Optional[time]=Query(None, description="End time in HH:MM:SS format"),
+                            limit : Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+                             format : Optional[str] = Query(None, description="json, columnar, msgpack or arrow. Defaults to the Accept header"),
+                             accept : Optional[str] = Header(None),
+                             accept_encoding : Optional[str] = Header(None),
+                             data_manager: DataManager=Depends(get_dm)):
+    seconds = candle_interval(interval)
+    format = response_format(format, accept, STORE_FORMATS)
+    await authorize(request, data_manager, key_name, api_key)
+    candle_data, content_encoding = await data_manager.get_candles(
+        type="lastday",
+        interval=seconds,
+        limit = limit,
+        start = start_time,
+        end=end_time,
+        format=format,
+        encoding=negotiate_encoding(accept_encoding)
+    )
+    return encoded_response(candle_data, content_encoding, format)
+
+@app.get("/get_historyIndicator")
+async def get_HistoryIndicatorData(request: Request, key_name:str,
+                             api_key : str,
+                             indicator : str = Query(..., pattern="^(sma|ema|rsi|vwap|bollinger)$"),
+                             source : str = Query("chart", pattern="^(chart|ohlc)$", description="chart prices or ohlc closes, vwap needs chart"),
+                             period : int = Query(20, ge=2, le=10000, description="Window, span or RSI period in points"),
+                             width : float = Query(2.0, gt=0, description="Bollinger band width in standard deviations"),
+                             start_date : Optional[date]=Query(None, description="Start date in YYYY-MM-DD format"),
+                             end_date : Optional[date]=Query(None, description="End date in YYYY-MM-DD format"),
+                            limit : Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+                             format : Optional[str] = Query(None, description="json, columnar, msgpack or arrow. Defaults to the Accept header"),
+                             accept : Optional[str] = Header(None),
+                             accept_encoding : Optional[str] = Header(None),
+                             data_manager: DataManager=Depends(get_dm)):
+    indicator_source(indicator, source)
+    format = response_format(format, accept, STORE_FORMATS)
+    await authorize(request, data_manager, key_name, api_key)
+    indicator_data, content_encoding = await data_manager.get_indicator(
+        dataset=source,
+        type="history",
+        name=indicator,
+        period=period,
+        width=width,
+        limit = limit,
+        start = start_date,
+        end=end_date,
+        format=format,
+        encoding=negotiate_encoding(accept_encoding)
+    )
+    return encoded_response(indicator_data, content_encoding, format)
+
+@app.get("/get_liveIndicator")
+async def get_liveIndicatorData(request: Request, key_name:str,
+                             api_key : str,
+                             indicator : str = Query(..., pattern="^(sma|ema|rsi|vwap|bollinger)$"),
+                             source : str = Query("chart", pattern="^(chart|ohlc)$", description="chart prices or ohlc closes, vwap needs chart"),
+                             period : int = Query(20, ge=2, le=10000, description="Window, span or RSI period in points"),
+                             width : float = Query(2.0, gt=0, description="Bollinger band width in standard deviations"),
+                             start_time : Optional[time]=Query(None, description="Start time in HH:MM:SS format"),
+                             end_time : Optional[time]=Query(None, description="End time in HH:MM:SS format"),
+                            limit : Optional[int] = Query(None, ge=1, le=MAX_LIMIT),
+                             format : Optional[str] = Query(None, description="json, columnar, msgpack or arrow. Defaults to the Accept header"),
+                             accept : Optional[str] = Header(None),
+                             accept_encoding : Optional[str] = Header(None),
+                             data_manager: DataManager=Depends(get_dm)):
+    indicator_source(indicator, source)
+    format = response_format(format, accept, STORE_FORMATS)
+    await authorize(request, data_manager, key_name, api_key)
+    indicator_data, content_encoding = await data_manager.get_indicator(
+        dataset=source,
+        type="lastday",
+        name=indicator,
+        period=period,
+        width=width,
+        limit = limit,
+        start = start_time,
+        end=end_time,
+        format=format,
+        encoding=negotiate_encoding(accept_encoding)
+    )
+    return encoded_response(indicator_data, content_encoding, format)
+
+@app.post("/batch")
+async def get_batchData(request: Request, batch: batch_request_schema,
+                        accept_encoding : Optional[str] = Header(None),
+                        data_manager: DataManager=Depends(get_dm)):
+    for query in batch.queries:
+        expected = date if query.type == "history" else time
+        if any(bound is not None and not isinstance(bound, expected) for bound in (query.start, query.end)):
+            raise HTTPException(status_code=400, detail=f"{query.type} queries take {expected.__name__} bounds")
+    # one authentication, charged one request per sub-query
+    await authorize(request, data_manager, batch.key_name, batch.api_key, cost=len(batch.queries))
+    batch_data, content_encoding = await data_manager.get_batch(
+        batch.queries,
+        format=batch.format,
+        encoding=negotiate_encoding(accept_encoding)
+    )
+    return encoded_response(batch_data, content_encoding, batch.format)
+
+def live_datasets(dataset: str):
+    return LIVE_DATASETS if dataset == "all" else (dataset,)
+
+@app.websocket("/ws/live")
+async def live_socket(websocket: WebSocket,
+                      key_name: str,
+                      api_key: str,
+                      dataset: str = Query("all", pattern="^(chart|ohlc|all)$")):
+    # authorized and charged once per connection, the session is not held open
+    async with get_dm_context() as data_manager:
+        limit = await data_manager.authorize_request(key_name, api_key)
+    if limit.status in (RedisService.AUTH_FAILED, RedisService.RATE_LIMITED, RedisService.THROTTLED):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    queue = live_hub.subscribe(live_datasets(dataset))
+    try:
+        while True:
+            _, message = await queue.get()
+            await websocket.send_text(message.decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_hub.unsubscribe(queue)
+
+@app.get("/sse/live")
+async def live_events(request: Request, key_name: str,
+                      api_key: str,
+                      dataset: str = Query("all", pattern="^(chart|ohlc|all)$")):
+    async with get_dm_context() as data_manager:
+        await authorize(request, data_manager, key_name, api_key)
+    return StreamingResponse(
+        live_hub.events(live_datasets(dataset)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,6 +1,8 @@
-from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
+from pydantic import BaseModel, Field
+from datetime import datetime, date, time
+from typing import Optional, Literal
+
+MAX_LIMIT = 100_000
 
 
 class chart_schema(BaseModel):
@@ -46,4 +48,16 @@ class upload_API_key_schema(BaseModel):
 class data_request_model(upload_API_key_schema):
     limit: Optional[int] = None
     start_date : Optional[datetime] = None
-    end_date : Optional[datetime] = None
\ No newline at end of file
+    end_date : Optional[datetime] = None
+
+class batch_query_schema(BaseModel):
+    dataset: Literal["chart", "ohlc"]
+    type: Literal["history", "lastday"]
+    # dates for history, times of day for lastday, as in the GET endpoints
+    start: Optional[date | time] = None
+    end: Optional[date | time] = None
+    limit: Optional[int] = Field(None, ge=1, le=MAX_LIMIT)
+
+class batch_request_schema(upload_API_key_schema):
+    queries: list[batch_query_schema] = Field(min_length=1, max_length=20)
+    format: Literal["json", "columnar"] = "json"
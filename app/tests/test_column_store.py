@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from crud.column_store import CHART_LAYOUT, ColumnStore, from_epoch, parse_interval
+
+
+def chart_store(start: datetime, hours: int):
+    timestamps = [start + timedelta(hours=i) for i in range(hours)]
+    return ColumnStore.from_columns(
+        CHART_LAYOUT,
+        timestamps,
+        {"coin_name": ["bitcoin"] * hours, "currency_name": ["usd"] * hours},
+        {"price": list(range(hours)), "market_cap": [1.0] * hours, "total_volume": [1.0] * hours},
+    )
+
+
+@pytest.mark.parametrize("value, seconds", [("15m", 900), ("4h", 14400), ("1d", 86400), ("1w", 604800), ("7d", 604800)])
+def test_parse_interval(value, seconds):
+    assert parse_interval(value) == seconds
+
+
+@pytest.mark.parametrize("value", ["0m", "8d", "2w", "99999999999999999999m", "1y", "m", "-1h"])
+def test_parse_interval_rejects(value):
+    with pytest.raises(ValueError):
+        parse_interval(value)
+
+
+def test_weekly_bars_start_on_monday():
+    # 2026-08-27 is a Thursday, the day weeks floored on the epoch start on
+    candles = chart_store(datetime(2026, 8, 27), 21 * 24).resample(parse_interval("1w"))
+    starts = [from_epoch(timestamp) for timestamp in candles.timestamps]
+    assert starts == [datetime(2026, 8, 24), datetime(2026, 8, 31), datetime(2026, 9, 7), datetime(2026, 9, 14)]
+    assert candles.values["open"][0] == 0
+    assert candles.values["open"][1] == 4 * 24
+
+
+def test_daily_bars_start_at_midnight():
+    candles = chart_store(datetime(2026, 8, 27, 6), 48).resample(parse_interval("1d"))
+    assert [from_epoch(timestamp) for timestamp in candles.timestamps] == [
+        datetime(2026, 8, 27), datetime(2026, 8, 28), datetime(2026, 8, 29)
+    ]
+
+
+def test_since_converts_aware_timestamps_to_utc():
+    store = chart_store(datetime(2026, 10, 18), 12)
+    newer = store.since(datetime.fromisoformat("2026-10-18T09:45:00+02:00"))
+    assert from_epoch(newer.timestamps[0]) == datetime(2026, 10, 18, 8)
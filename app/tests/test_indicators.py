@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from crud.column_store import CHART_LAYOUT, ColumnStore
+from crud.indicators import rsi, update_indicator
+
+# Wilder's 14 period example from StockCharts; the reference is TA-Lib's RSI,
+# their sheet rounds the averages to cents and is off in the second decimal
+CLOSES = [
+    44.34, 44.09, 44.15, 43.61, 44.33, 44.83, 45.10, 45.42, 45.84, 46.08, 45.89,
+    46.03, 45.61, 46.28, 46.28, 46.00, 46.03, 46.41, 46.22, 45.64, 46.21, 46.25,
+    45.71, 46.45, 45.78, 45.35, 44.03, 44.18, 44.22, 44.57, 43.42, 42.66, 43.13,
+]
+REFERENCE = [
+    70.464, 66.250, 66.481, 69.347, 66.295, 57.915, 62.881, 63.209, 56.012, 62.340,
+    54.671, 50.387, 40.019, 41.493, 41.902, 45.499, 37.323, 33.090, 37.789,
+]
+
+def test_rsi_matches_reference():
+    out = rsi(np.array(CLOSES), None, 14, 0, {})[0]["rsi"]
+    assert np.isnan(out[:14]).all()
+    assert out[14:] == pytest.approx(REFERENCE, abs=1e-3)
+
+
+@pytest.mark.parametrize("split", [3, 14, 15, 20])
+def test_rsi_state_carries_across_calls(split):
+    prices = np.array(CLOSES)
+    whole = rsi(prices, None, 14, 0, {})[0]["rsi"]
+    head, state = rsi(prices[:split], None, 14, 0, {})
+    # the next call starts from the last point already seen
+    tail = rsi(prices[split - 1:], None, 14, 0, state)[0]["rsi"]
+    assert np.concatenate((head["rsi"], tail[1:])) == pytest.approx(whole, nan_ok=True)
+
+
+def test_update_indicator_extends_rsi():
+    timestamps = np.arange(len(CLOSES), dtype=np.int64) * 3600
+    values = {"price": np.array(CLOSES), "market_cap": np.ones(len(CLOSES)), "total_volume": np.ones(len(CLOSES))}
+    store = ColumnStore(CHART_LAYOUT, timestamps, {}, values)
+    series, state, _ = update_indicator("chart", "rsi", 14, 0, store.take(slice(0, 20)))
+    series, state, changed = update_indicator("chart", "rsi", 14, 0, store, series, state)
+    assert changed
+    assert series.values["rsi"] == pytest.approx(REFERENCE, abs=1e-3)
@@ -0,0 +1,82 @@
+from datetime import date, datetime
+
+from sqlalchemy.dialects import mssql
+
+from db import chartHistory, chartLive
+from crud.chart_service import ChartService
+from crud.key_range import key_range, after_keys, date_bounds, to_keys, watermark_statement
+
+
+def compile_sql(clause):
+    return str(clause.compile(dialect=mssql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def where_sql(clauses):
+    return " AND ".join(compile_sql(clause) for clause in clauses)
+
+
+def order_by(sql):
+    return sql.split("ORDER BY", 1)[1]
+
+
+def test_whole_days_are_a_date_key_range():
+    sql = where_sql(key_range(chartHistory, *date_bounds(date(2024, 1, 1), date(2024, 1, 31))))
+    assert "gold_fact_hourlyprices_last90days.date_key >= '20240101'" in sql
+    assert "gold_fact_hourlyprices_last90days.date_key <= '20240131'" in sql
+    assert "time_key" not in sql
+
+
+def test_times_of_day_seek_on_date_key_then_time_key():
+    sql = where_sql(key_range(chartLive, datetime(2024, 1, 1, 22, 30), datetime(2024, 1, 2, 1, 15)))
+    assert "gold_fact_5minprices_lastday.date_key >= '20240101'" in sql
+    assert "gold_fact_5minprices_lastday.date_key > '20240101' OR gold_fact_5minprices_lastday.time_key >= '2230'" in sql
+    assert "gold_fact_5minprices_lastday.date_key <= '20240102'" in sql
+    assert "gold_fact_5minprices_lastday.date_key < '20240102' OR gold_fact_5minprices_lastday.time_key <= '0115'" in sql
+
+
+def test_after_keys_is_strictly_after():
+    sql = compile_sql(after_keys(chartHistory, "20240102", "1200"))
+    assert "date_key >= '20240102'" in sql
+    assert "date_key > '20240102' OR gold_fact_hourlyprices_last90days.time_key > '1200'" in sql
+
+
+def test_chart_statement_orders_by_the_fact_keys():
+    sql = compile_sql(ChartService(None).chart_statement(chartHistory))
+    assert order_by(sql).strip() == "gold_fact_hourlyprices_last90days.date_key, gold_fact_hourlyprices_last90days.time_key"
+    assert "concat" not in sql.lower()
+    assert "JOIN" not in sql
+
+
+def test_history_statement():
+    sql = compile_sql(ChartService(None).chart_history_statement(
+        100, date(2024, 1, 1), date(2024, 1, 2), datetime(2024, 1, 1, 12, 0)
+    ))
+    assert sql.startswith("SELECT TOP 100 ")
+    where, order = sql.split("WHERE", 1)[1].split("ORDER BY")
+    assert "date_key >= '20240101'" in where
+    assert "date_key <= '20240102'" in where
+    assert "time_key > '1200'" in where
+    assert "date_key, gold_fact_hourlyprices_last90days.time_key" in order
+    assert "concat" not in sql.lower()
+
+
+def test_page_statement_seeks_past_the_cursor():
+    sql = compile_sql(ChartService(None).chart_page_statement(("20240101", "0500"), date(2024, 1, 2), 50))
+    assert sql.startswith("SELECT TOP 50 ")
+    where = sql.split("WHERE", 1)[1].split("ORDER BY")[0]
+    assert "date_key > '20240101' OR gold_fact_hourlyprices_last90days.time_key > '0500'" in where
+    assert "date_key <= '20240102'" in where
+    assert "concat" not in sql.lower()
+
+
+def test_watermark_reads_the_newest_key():
+    sql = compile_sql(watermark_statement(chartLive))
+    assert sql.startswith("SELECT TOP 1 ")
+    assert order_by(sql).strip() == "gold_fact_5minprices_lastday.date_key DESC, gold_fact_5minprices_lastday.time_key DESC"
+
+
+def test_aware_since_is_converted_to_utc():
+    since = datetime.fromisoformat("2026-10-18T09:45:00+02:00")
+    assert to_keys(since) == ("20261018", "0745")
+    sql = compile_sql(ChartService(None).chart_history_statement(since=since))
+    assert "time_key > '0745'" in sql
@@ -0,0 +1,15 @@
+-- Per-second and per-minute limits on api_keys (rate_limit_per_second,
+-- rate_limit_per_minute on db.api_keys.APIkey). Safe to run more than once.
+-- Existing keys get the model defaults, 0 turns a tier off.
+
+IF COL_LENGTH('dbo.api_keys', 'rate_limit_per_second') IS NULL
+    ALTER TABLE dbo.api_keys
+        ADD rate_limit_per_second INT NOT NULL
+        CONSTRAINT DF_api_keys_rate_limit_per_second DEFAULT 5;
+GO
+
+IF COL_LENGTH('dbo.api_keys', 'rate_limit_per_minute') IS NULL
+    ALTER TABLE dbo.api_keys
+        ADD rate_limit_per_minute INT NOT NULL
+        CONSTRAINT DF_api_keys_rate_limit_per_minute DEFAULT 60;
+GO